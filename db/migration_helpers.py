@@ -0,0 +1,71 @@
+# db/migration_helpers.py
+"""Помощники для Alembic-миграций, перезаписывающих данные в больших таблицах.
+
+Вместо одного UPDATE/SELECT по всей таблице (всё в одной транзакции и в
+памяти процесса) строки читаются страницами по первичному ключу, и каждая
+страница фиксируется отдельно внутри ``autocommit_block()``.
+
+Пример использования внутри ``upgrade()``::
+
+    from alembic import op
+    import sqlalchemy as sa
+    from db.migration_helpers import migrate_in_batches
+
+    sms = sa.table("sms_data", sa.column("id"), sa.column("card"))
+
+    def _fix(bind, rows):
+        bind.execute(
+            sa.update(sms).where(sms.c.id == sa.bindparam("_id")).values(card=sa.bindparam("card")),
+            [{"_id": r.id, "card": r.card[-4:]} for r in rows],
+        )
+
+    migrate_in_batches(sms, _fix, batch_size=1000)
+"""
+from __future__ import annotations
+
+from typing import Any, Callable, Iterator, Sequence
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.engine import Connection, Row
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def iter_pages(
+    bind: Connection,
+    table: sa.TableClause,
+    *,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    key: str = "id",
+) -> Iterator[Sequence[Row[Any]]]:
+    """Keyset-пагинация по *key*: в памяти одновременно не больше одной страницы."""
+    key_col = table.c[key]
+    last_key = None
+    while True:
+        stmt = sa.select(table).order_by(key_col).limit(batch_size)
+        if last_key is not None:
+            stmt = stmt.where(key_col > last_key)
+        rows = bind.execute(stmt).all()
+        if not rows:
+            return
+        yield rows
+        last_key = getattr(rows[-1], key)
+
+
+def migrate_in_batches(
+    table: sa.TableClause,
+    apply: Callable[[Connection, Sequence[Row[Any]]], None],
+    *,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    key: str = "id",
+) -> None:
+    """Прогоняет *apply* по страницам таблицы, фиксируя каждую страницу сразу.
+
+    Вызывать только из ``upgrade()``/``downgrade()`` – используется текущий
+    контекст Alembic.
+    """
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        for rows in iter_pages(bind, table, batch_size=batch_size, key=key):
+            apply(bind, rows)
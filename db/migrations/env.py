@@ -3,7 +3,6 @@
 import asyncio
 from logging.config import fileConfig
 
-from sqlalchemy import pool
 from sqlalchemy.engine import Connection
 from sqlalchemy.ext.asyncio import create_async_engine
 
@@ -45,7 +44,14 @@ def run_migrations_offline() -> None:
 
 def do_run_migrations(connection: Connection) -> None:
     """Общая синхронная функция для запуска миграций."""
-    context.configure(connection=connection, target_metadata=target_metadata)
+    # Каждая ревизия – в своей транзакции: длинная цепочка миграций не держит
+    # одну транзакцию (и её блокировки) до самого конца. Миграции с перезаписью
+    # данных дополнительно бьют работу на страницы через db.migration_helpers.
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        transaction_per_migration=True,
+    )
     with context.begin_transaction():
         context.run_migrations()
 
@@ -58,18 +64,24 @@ async def run_migrations_online() -> None:
 
     # Создаем асинхронный движок НАПРЯМУЮ из URL в настройках.
     # Это избавляет от всех проблем с engine_from_config.
+    # Небольшой пул вместо NullPool: повторные подключения (autocommit_block,
+    # пакетные миграции) берут уже «тёплое» соединение без нового handshake.
     connectable = create_async_engine(
         settings.database_url_async,
-        poolclass=pool.NullPool,
+        pool_size=2,
+        max_overflow=0,
+        pool_pre_ping=True,
+        pool_recycle=1800,
     )
 
-    # Устанавливаем асинхронное соединение
-    async with connectable.connect() as connection:
-        # Запускаем синхронную логику миграций внутри асинхронного контекста
-        await connection.run_sync(do_run_migrations)
-
-    # Корректно освобождаем ресурсы движка
-    await connectable.dispose()
+    try:
+        # Устанавливаем асинхронное соединение
+        async with connectable.connect() as connection:
+            # Запускаем синхронную логику миграций внутри асинхронного контекста
+            await connection.run_sync(do_run_migrations)
+    finally:
+        # Корректно освобождаем ресурсы движка – даже если миграция упала
+        await connectable.dispose()
 
 
 # Главный блок логики, который определяет, какой режим запускать
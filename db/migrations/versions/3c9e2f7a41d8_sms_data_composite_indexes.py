@@ -0,0 +1,38 @@
+"""sms_data composite indexes
+
+Revision ID: 3c9e2f7a41d8
+Revises: dcbadcb88d59
+Create Date: 2026-10-15 10:12:44.512306
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c9e2f7a41d8'
+down_revision: Union[str, Sequence[str], None] = 'dcbadcb88d59'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY не блокирует запись, но не может выполняться в транзакции
+    with op.get_context().autocommit_block():
+        op.create_index('idx_sms_sender_datetime', 'sms_data', ['sender', sa.text('datetime DESC')],
+                        unique=False, postgresql_concurrently=True)
+        op.create_index('idx_sms_card_datetime', 'sms_data', ['card', sa.text('datetime DESC')],
+                        unique=False, postgresql_concurrently=True)
+        op.drop_index('idx_sms_sender', table_name='sms_data', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index('idx_sms_sender', 'sms_data', ['sender'],
+                        unique=False, postgresql_concurrently=True)
+        op.drop_index('idx_sms_card_datetime', table_name='sms_data', postgresql_concurrently=True)
+        op.drop_index('idx_sms_sender_datetime', table_name='sms_data', postgresql_concurrently=True)
@@ -0,0 +1,47 @@
+"""sms_data amounts in cents
+
+Revision ID: 5b7d0e9c2a16
+Revises: 3c9e2f7a41d8
+Create Date: 2026-10-15 11:02:17.084913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b7d0e9c2a16'
+down_revision: Union[str, Sequence[str], None] = '3c9e2f7a41d8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Один ALTER на колонку: Postgres переписывает таблицу за один проход
+    op.alter_column('sms_data', 'amount',
+                    existing_type=sa.Numeric(precision=14, scale=2),
+                    type_=sa.BigInteger(),
+                    existing_nullable=False,
+                    postgresql_using='round(amount * 100)::bigint')
+    op.alter_column('sms_data', 'balance',
+                    existing_type=sa.Numeric(precision=14, scale=2),
+                    type_=sa.BigInteger(),
+                    existing_nullable=True,
+                    postgresql_using='round(balance * 100)::bigint')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.alter_column('sms_data', 'balance',
+                    existing_type=sa.BigInteger(),
+                    type_=sa.Numeric(precision=14, scale=2),
+                    existing_nullable=True,
+                    postgresql_using='(balance / 100.0)::numeric(14, 2)')
+    op.alter_column('sms_data', 'amount',
+                    existing_type=sa.BigInteger(),
+                    type_=sa.Numeric(precision=14, scale=2),
+                    existing_nullable=False,
+                    postgresql_using='(amount / 100.0)::numeric(14, 2)')
@@ -1,13 +1,38 @@
 # db/models.py
 from datetime import datetime as dt
-from decimal import Decimal
-from sqlalchemy import Integer, String, Numeric, DateTime, Index
+from decimal import Decimal, ROUND_HALF_UP
+from sqlalchemy import BigInteger, Integer, String, DateTime, Index, desc
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 from sqlalchemy.dialects.postgresql import insert
 
 class Base(DeclarativeBase):
     pass
 
+
+class Cents(TypeDecorator):
+    """
+    Денежная сумма, хранящаяся в БД как BIGINT в копейках/центах.
+
+    Наружу (ORM, фильтры, insert) по-прежнему ходит Decimal с двумя знаками,
+    а Postgres хранит и суммирует int8 вместо переменной длины NUMERIC.
+    """
+
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        cents = Decimal(str(value)).scaleb(2)
+        return int(cents.to_integral_value(rounding=ROUND_HALF_UP))
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return Decimal(value).scaleb(-2)
+
+
 class SmsData(Base):
     __tablename__ = "sms_data"
 
@@ -18,13 +43,13 @@ class SmsData(Base):
     sender: Mapped[str] = mapped_column(String, nullable=False)
     datetime: Mapped[dt] = mapped_column(DateTime(timezone=True), nullable=False)
     card: Mapped[str] = mapped_column(String(4), nullable=False)
-    amount: Mapped[Decimal] = mapped_column(Numeric(14, 2), nullable=False)
+    amount: Mapped[Decimal] = mapped_column(Cents, nullable=False)
     currency: Mapped[str] = mapped_column(String(3), nullable=False)
     txn_type: Mapped[str] = mapped_column(String, nullable=False)
 
     # Необязательные поля (nullable=True по умолчанию)
     # Используем `| None` (или Optional[...]) чтобы указать это
-    balance: Mapped[Decimal | None] = mapped_column(Numeric(14, 2))
+    balance: Mapped[Decimal | None] = mapped_column(Cents)
     merchant: Mapped[str | None] = mapped_column(String)
     address: Mapped[str | None] = mapped_column(String)
     city: Mapped[str | None] = mapped_column(String)
@@ -33,7 +58,11 @@ class SmsData(Base):
     parser_version: Mapped[str | None] = mapped_column(String)
 
     __table_args__ = (
-        Index("idx_sms_sender", "sender"),
+        # Запросы «последние N операций отправителя / карты» идут по
+        # (sender|card, datetime) – составные индексы покрывают их целиком,
+        # а (sender, …) заодно заменяет отдельный индекс по sender.
+        Index("idx_sms_sender_datetime", "sender", desc("datetime")),
+        Index("idx_sms_card_datetime", "card", desc("datetime")),
         Index("idx_sms_datetime", "datetime"),
         Index("idx_sms_txn_type", "txn_type"),
     )
@@ -6,7 +6,16 @@ settings = get_settings()
 
 engine = create_async_engine(
     settings.database_url_async,
-    pool_size=10, echo=False,
+    pool_size=20,
+    max_overflow=30,
+    pool_timeout=30,
+    pool_recycle=3600,     # обновляем соединения раньше idle-timeout Postgres
+    pool_pre_ping=True,    # не отдаём из пула «мёртвые» соединения
+    echo=False,
+    connect_args={
+        "prepared_statement_cache_size": 500,
+        # Передаются в startup-пакете asyncpg – без лишних SET на каждое соединение
+        "server_settings": {"jit": "off", "timezone": "UTC"},
+    },
 )
 SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
-
@@ -10,12 +10,14 @@
 from __future__ import annotations
 
 import os
-from functools import lru_cache
+from functools import cached_property, lru_cache
 from pathlib import Path
 from typing import Literal, Optional
 
 from pydantic import Field, computed_field, model_validator
-from pydantic_settings import BaseSettings
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+__all__ = ["Settings", "get_settings"]
 
 # --------------------------------------------------------------------------- #
 # Основные настройки
@@ -31,6 +33,17 @@ class Settings(BaseSettings):
     pb_email: str = Field(env="PB_EMAIL") # type: ignore
     pb_password: str = Field(env="PB_PASSWORD") # type: ignore
 
+    # ── Пул HTTP-соединений к PocketBase (httpx.Limits) ─────────────────────
+    pb_max_connections: int = Field(100, env="PB_MAX_CONNECTIONS") # type: ignore
+    pb_max_keepalive_connections: int = Field(100, env="PB_MAX_KEEPALIVE_CONNECTIONS") # type: ignore
+    pb_keepalive_expiry: float = Field(60.0, env="PB_KEEPALIVE_EXPIRY") # type: ignore
+    # HTTP/2 (нужен пакет h2) – имеет смысл, только если PB за TLS-ingress
+    pb_http2: bool = Field(False, env="PB_HTTP2") # type: ignore
+    # Оптимистичный upsert (сразу POST, PATCH только при дубликате). Без
+    # UNIQUE-индекса по msg_id POST молча создаёт дубли, поэтому порядок такой:
+    # удалить дубли msg_id в коллекции → создать UNIQUE-индекс → включить флаг.
+    pb_unique_msg_id: bool = Field(False, env="PB_UNIQUE_MSG_ID") # type: ignore
+
     # ── Sentry ───────────────────────────────────────────────────────────────
     sentry_dsn: Optional[str] = Field(None, env="SENTRY_DSN") # type: ignore
     enable_sentry: bool = Field(False, env="ENABLE_SENTRY") # type: ignore
@@ -61,10 +74,15 @@ class Settings(BaseSettings):
         self.backup_dir.mkdir(parents=True, exist_ok=True)
         return self
 
-    class Config:
-        env_file = ".env"
-        env_file_encoding = "utf-8"
-        case_sensitive = False
+    # frozen: настройки не меняются после старта, а вычисляемые DSN
+    # ниже можно безопасно закешировать на экземпляре.
+    model_config = SettingsConfigDict(
+        env_file=".env",
+        env_file_encoding="utf-8",
+        case_sensitive=False,
+        extra="ignore",
+        frozen=True,
+    )
 
     log_dir: str = Field(env="LOG_DIR") # type: ignore
     # ── PostgreSQL ─────────────────────────────────────────────────────────
@@ -77,7 +95,7 @@ class Settings(BaseSettings):
     postgres_port: int = Field(5432, env="POSTGRES_PORT") # type: ignore
 
     @computed_field # Используем @computed_field для Pydantic v2
-    @property
+    @cached_property
     def database_url(self) -> str:
         """
         Генерирует URL для подключения к базе данных SQLAlchemy.
@@ -90,7 +108,7 @@ class Settings(BaseSettings):
         )
 
     @computed_field # Используем @computed_field для Pydantic v2
-    @property
+    @cached_property
     def database_url_async(self) -> str:
         """
         Генерирует URL для подключения к базе данных SQLAlchemy.
@@ -1,6 +1,10 @@
 from decimal import Decimal, InvalidOperation
+from functools import lru_cache
 import re
 
+_NON_NUMERIC_RE = re.compile(r'[^0-9.-]')   # финальная очистка хвоста
+
+
 def parse_ambiguous_decimal(num_str: str) -> Decimal:
     """
     Пытается преобразовать строку с неизвестным форматом числа в Decimal.
@@ -10,6 +14,13 @@ def parse_ambiguous_decimal(num_str: str) -> Decimal:
     if not isinstance(num_str, str):
         # Если это уже число, просто преобразуем
         return Decimal(num_str)
+    return _parse_ambiguous_decimal_str(num_str)
+
+
+@lru_cache(maxsize=4096)
+def _parse_ambiguous_decimal_str(num_str: str) -> Decimal:
+    # Суммы и балансы одного банка часто повторяются, а Decimal неизменяем –
+    # результат можно безопасно отдавать из кеша.
 
     # 1. Предварительная очистка: убираем пробелы по краям и внутри
     cleaned_str = num_str.strip().replace(' ', '')
@@ -56,9 +67,8 @@ def parse_ambiguous_decimal(num_str: str) -> Decimal:
     # Если разделителей нет
     else:
         final_str = cleaned_str
-    final_str = re.sub(r'[^0-9.-]', '', final_str)
+    final_str = _NON_NUMERIC_RE.sub('', final_str)
     try:
         return Decimal(final_str)
     except InvalidOperation:
         raise ValueError(f"Не удалось преобразовать строку '{num_str}' в число после очистки до '{final_str}'")
-
@@ -3,8 +3,9 @@ from datetime import datetime
 from decimal import Decimal
 from typing import Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 from libs.models import TxnType   # ← единственный enum!
+from libs.decimal_utils import parse_ambiguous_decimal
 
 class ParsedSmsCore(BaseModel):
     """Мини-схема, которую возвращает Gemini."""
@@ -17,3 +18,17 @@ class ParsedSmsCore(BaseModel):
     city: Optional[str]
     address: Optional[str]
     balance: Optional[Decimal]
+
+    # --- нормализация ответа Gemini (до валидации типов) ---------------------
+    # Gemini отдаёт все поля строками, поэтому чистка идёт прямо в валидаторе:
+    # кешированный dict не нужно переписывать по полям перед проверкой.
+    @field_validator("card", mode="before")
+    def _last_card_digits(cls, v: Optional[str]) -> Optional[str]:  # noqa: N805
+        if v is None:
+            return v
+        return v.replace('*', '').replace(' ', '')[:4]
+
+    @field_validator("amount", "balance", mode="before")
+    def _ambiguous_decimal(cls, v) -> Decimal:  # noqa: N805
+        # По схеме Gemini значение – уже строка; str() только для прочего
+        return parse_ambiguous_decimal(v if isinstance(v, str) else str(v))
@@ -7,6 +7,7 @@
 from __future__ import annotations
 
 import logging
+import weakref
 from async_lru import alru_cache
 from typing import Awaitable, Callable
 
@@ -15,6 +16,8 @@ from nats.aio.client import Client as NATS
 from nats.js.api import StorageType, RetentionPolicy
 from nats.js.api import StreamConfig
 from nats.js.api import PubAck
+from nats.js.client import JetStreamContext
+from pydantic import BaseModel
 from libs.config import get_settings
 from libs.models import RawSMS
 
@@ -65,7 +68,7 @@ async def ensure_stream(nc: NATS):
     subjects = [SUBJECT_RAW, SUBJECT_PARSED,
                 SUBJECT_FAILED, SUBJECT_PROCESSING, SUBJECT_CATEGORIZED]
     logging.debug(f"Проверка и создание стрима '{stream_name}' для субъектов {subjects}...")
-    jsm = nc.jetstream()
+    jsm = get_jetstream(nc)
     
     config = StreamConfig(
         name=stream_name,
@@ -89,9 +92,44 @@ async def ensure_stream(nc: NATS):
         logging.error(f"❌ Произошла непредвиденная ошибка при создании/обновлении стрима: {e}")
         raise
 
+# Подключения, для которых стрим уже проверен, и их JetStream-контексты.
+# Слабые ссылки: закрытое и выброшенное подключение не держится в памяти.
+_ENSURED_CONNECTIONS: "weakref.WeakSet[NATS]" = weakref.WeakSet()
+_JETSTREAMS: "weakref.WeakKeyDictionary[NATS, JetStreamContext]" = weakref.WeakKeyDictionary()
+
+
+async def ensure_stream_once(nc: NATS) -> None:
+    """
+    `ensure_stream`, но не чаще одного раза на подключение.
+
+    Полная проверка – это RPC `stream_info` к серверу; на горячем пути
+    (публикация каждой SMS) достаточно сделать её при первом обращении.
+    """
+    if nc in _ENSURED_CONNECTIONS:
+        return
+    await ensure_stream(nc)
+    _ENSURED_CONNECTIONS.add(nc)
+
+
+def get_jetstream(nc: NATS) -> JetStreamContext:
+    """Один JetStream-контекст на подключение вместо `nc.jetstream()` на каждое сообщение."""
+    js = _JETSTREAMS.get(nc)
+    if js is None:
+        js = _JETSTREAMS[nc] = nc.jetstream()
+    return js
+
 # ---------------------------------------------------------------------------
 # Public API
 # ---------------------------------------------------------------------------
+def model_to_bytes(model: BaseModel) -> bytes:
+    """JSON-байты модели для публикации в NATS.
+
+    Сериализатор pydantic-core сразу отдаёт bytes – без промежуточной str
+    из `model_dump_json()` и её `.encode()`. Результат байт-в-байт тот же.
+    """
+    return model.__pydantic_serializer__.to_json(model)
+
+
 async def publish_raw_sms(
     nc: NATS | None,
     sms: RawSMS,
@@ -120,19 +158,22 @@ async def publish_raw_sms(
     if nc is None:  # pragma: no cover – convenience
         nc = await get_nats_connection()
 
-    # Убеждаемся, что стрим существует и слушает все нужные каналы
-    await ensure_stream(nc=nc)
+    # Убеждаемся (один раз на подключение), что стрим существует и слушает все нужные каналы
+    await ensure_stream_once(nc)
 
-    js = nc.jetstream()
-    payload = sms.model_dump_json().encode('utf-8')
+    js = get_jetstream(nc)
+    payload = model_to_bytes(sms)
     ack = await js.publish(subject, payload)
     return ack
 
 
 __all__ = [
     "publish_raw_sms",
+    "model_to_bytes",
     "get_nats_connection",
     "ensure_stream",
+    "ensure_stream_once",
+    "get_jetstream",
     "SUBJECT_RAW",
     "SUBJECT_PARSED",
     "SUBJECT_FAILED",
@@ -5,6 +5,9 @@
 * Provides a single public helper – :func:`upsert_parsed_sms` – consumed by the
   PB writer service.  The helper is **idempotent** thanks to a unique
   ``msg_id`` field that we store with every record.
+* :func:`upsert_parsed_sms_many` does the same for a batch with one search
+  request per :data:`FIND_IDS_CHUNK` ids (``msg_id='a' || msg_id='b' ...``)
+  instead of one per record.
 
 Dependencies
 ------------
@@ -12,19 +15,34 @@ Pure-stdlib + ``httpx`` and ``tenacity`` (both already in *poetry* deps).
 """
 from __future__ import annotations
 
+import asyncio
 import hashlib
 import logging
-from functools import lru_cache
+import threading
 from typing import Any, List, Literal, Mapping, Optional
 
 import httpx
-from tenacity import RetryError, retry, stop_after_attempt, wait_exponential
+from pydantic_core import to_json
+from tenacity import (
+    RetryError,
+    retry,
+    retry_if_not_exception_type,
+    stop_after_attempt,
+    wait_exponential,
+)
 
 from libs.config import get_settings
 from libs.models import ParsedSMS
 from libs.sentry import sentry_capture
 
-__all__ = ["PocketBaseClient", "get_pb_client", "upsert_parsed_sms"]
+__all__ = [
+    "FilterValueError",
+    "PocketBaseClient",
+    "check_filter_value",
+    "get_pb_client",
+    "upsert_parsed_sms",
+    "upsert_parsed_sms_many",
+]
 
 logger = logging.getLogger(__name__)
 
@@ -32,72 +50,197 @@ logger = logging.getLogger(__name__)
 # PocketBase client (async)
 # ---------------------------------------------------------------------------
 
+_JSON_HEADERS = {"Content-Type": "application/json"}
 
-import httpx
-from tenacity import retry, wait_exponential, stop_after_attempt
-from typing import Any, Mapping, List
-import logging
 
-# Предполагается, что у вас есть настроенный logger
-logger = logging.getLogger(__name__)
+def _json_body(kwargs: dict[str, Any]) -> dict[str, Any]:
+    """
+    Заменяет `json=` на готовые байты от pydantic-core: сериализатор на Rust
+    сразу отдаёт bytes, без json.dumps и последующего `.encode()` внутри httpx.
+    """
+    if "json" in kwargs:
+        kwargs["content"] = to_json(kwargs.pop("json"))
+        kwargs["headers"] = {**_JSON_HEADERS, **kwargs.get("headers", {})}
+    return kwargs
+
+
+def _is_duplicate_msg_id(resp: httpx.Response) -> bool:
+    """400 от PocketBase из-за нарушения уникальности поля ``msg_id``."""
+    if resp.status_code != 400:
+        return False
+    try:
+        errors = resp.json().get("data") or {}
+    except ValueError:
+        return False
+    return errors.get("msg_id", {}).get("code") == "validation_not_unique"
+
+
+class FilterValueError(ValueError):
+    """Значение нельзя записать в строковый литерал filter PocketBase."""
+
+
+def check_filter_value(value: str) -> None:
+    """
+    Парсер фильтров PB снимает экранирование только у ``\\'`` – ``\\\\`` он
+    не превращает в ``\\``, поэтому значение с обратным слешем записать
+    в литерал нельзя (не совпадёт или «съест» закрывающую кавычку).
+
+    Проверять до вызова ``upsert``/``upsert_many``: повторять такую ошибку
+    бессмысленно, ретраи её пропускают.
+    """
+    if "\\" in value:
+        raise FilterValueError(f"Обратный слеш в значении фильтра PocketBase не поддерживается: {value!r}")
+
+
+def _quote(value: str) -> str:
+    """Строковый литерал для filter PocketBase: кавычка в значении экранируется."""
+    check_filter_value(value)
+    return "'" + value.replace("'", "\\'") + "'"
+
+
+# PocketBase 0.23+ отклоняет filter длиннее ~3500 символов (и с большим числом
+# выражений). msg_id – sha1/md5 в hex, терм ``msg_id='…'`` до ~50 символов
+# вместе с `` || ``, поэтому ищем не больше 30 id за запрос.
+FIND_IDS_CHUNK = 30
+
+
+def _msg_id_filter(msg_ids: List[str]) -> dict[str, Any]:
+    """Параметры поиска записей сразу по нескольким msg_id (одним запросом)."""
+    return {
+        "filter": " || ".join(f"msg_id={_quote(msg_id)}" for msg_id in msg_ids),
+        "page": 1,
+        "perPage": len(msg_ids),
+        "fields": "id,msg_id",
+    }
+
+
+# Ретрай запросов к PocketBase; невалидное значение фильтра не ретраим
+_retry_pb = retry(
+    wait=wait_exponential(multiplier=1, min=2, max=30),
+    stop=stop_after_attempt(5),
+    retry=retry_if_not_exception_type(FilterValueError),
+)
+
+
+def _pool_limits() -> httpx.Limits:
+    """
+    Лимиты пула соединений из настроек. У httpx по умолчанию живыми держатся
+    лишь 20 соединений по 5 с – пачка параллельных PATCH/POST из upsert_many
+    каждый раз открывала бы новые TCP-соединения.
+    """
+    settings = get_settings()
+    return httpx.Limits(
+        max_connections=settings.pb_max_connections,
+        max_keepalive_connections=settings.pb_max_keepalive_connections,
+        keepalive_expiry=settings.pb_keepalive_expiry,
+    )
+
+
+def _unique_msg_id(value: bool | None) -> bool:
+    """Есть ли в коллекциях UNIQUE-индекс по msg_id (по умолчанию – из настроек)."""
+    return get_settings().pb_unique_msg_id if value is None else value
+
 
 class PocketBaseClient:
     """
     Tiny sync-client for the subset of PocketBase endpoints we use.
     """
 
-    def __init__(self, *, base_url: str, email: str, password: str) -> None:
+    def __init__(
+        self,
+        *,
+        base_url: str,
+        email: str,
+        password: str,
+        limits: httpx.Limits | None = None,
+        unique_msg_id: bool | None = None,
+    ) -> None:
         self._base_url = base_url.rstrip("/")
         self._email = email
         self._password = password
         # Используем синхронный клиент httpx.Client
-        self._client = httpx.Client(base_url=self._base_url, timeout=10.0)
+        self._client = httpx.Client(
+            base_url=self._base_url, timeout=10.0, limits=limits or _pool_limits()
+        )
         self._token: str | None = None
+        self._unique_msg_id = _unique_msg_id(unique_msg_id)
 
     # ------------------------------------------------------------- low level
     def _get(self, path: str, **kwargs: Any) -> httpx.Response:
         return self._client.get(path, **kwargs)
 
     def _post(self, path: str, **kwargs: Any) -> httpx.Response:
-        return self._client.post(path, **kwargs)
+        return self._client.post(path, **_json_body(kwargs))
 
     def _patch(self, path: str, **kwargs: Any) -> httpx.Response:
-        return self._client.patch(path, **kwargs)
+        return self._client.patch(path, **_json_body(kwargs))
 
     # -------------------------------------------------------------- business
 
-    @retry(wait=wait_exponential(multiplier=1, min=2, max=30), stop=stop_after_attempt(5))
+    @_retry_pb
     def upsert(self, collection: str, record: Mapping[str, Any], *, msg_id: str) -> None:
-        """Create or update a record guaranteeing *idempotency* by *msg_id*."""
-        filter_param = {
-            "filter": f"msg_id='{msg_id}'",
-            "page": 1,
-            "perPage": 1,
-        }
+        """
+        Create or update a record guaranteeing *idempotency* by *msg_id*.
+
+        С UNIQUE-индексом по ``msg_id`` (``PB_UNIQUE_MSG_ID``) запись создаётся
+        оптимистично (новые SMS – основной случай, это один запрос вместо
+        поиска + записи): индекс отклоняет дубликат с 400, и только тогда ищем
+        запись и делаем PATCH. Без индекса – поиск, затем PATCH/POST.
+        """
+        if not self._unique_msg_id:
+            self._write_batch(collection, {msg_id: record})
+            return
+        resp = self._post(f"/api/collections/{collection}/records", json=record)
+        if not _is_duplicate_msg_id(resp):
+            try:
+                resp.raise_for_status()
+            except httpx.HTTPStatusError as exc:
+                logger.error("PocketBase insert failed: %s", exc)
+                raise  # let tenacity retry
+            logger.info("Inserted new record into %s", collection)
+            return
+
         try:
-            resp = self._get(f"/api/collections/{collection}/records", params=filter_param)
+            rec_id = self._find_ids(collection, [msg_id])[msg_id]
+            resp = self._patch(f"/api/collections/{collection}/records/{rec_id}", json=record)
             resp.raise_for_status()
-            items = resp.json().get("items", [])
-            if items:
-                rec_id = items[0]["id"]
-                resp = self._patch(
-                    f"/api/collections/{collection}/records/{rec_id}",
-                    json=record,
-                )
-                resp.raise_for_status()
-                logger.info("Patched existing record %s in %s", rec_id, collection)
-                return
-        except httpx.HTTPStatusError as exc:
-            logger.warning("PocketBase search failed: %s", exc)
+            logger.info("Patched existing record %s in %s", rec_id, collection)
+        except (httpx.HTTPStatusError, KeyError) as exc:
+            logger.warning("PocketBase update failed: %s", exc)
             raise  # let tenacity retry
 
-        try:
-            resp = self._post(f"/api/collections/{collection}/records", json=record)
+    @_retry_pb
+    def upsert_many(self, collection: str, records: List[tuple[str, Mapping[str, Any]]]) -> None:
+        """
+        Batch-версия :meth:`upsert`: один поиск по всем *msg_id* пачки вместо
+        поиска на каждую запись, затем PATCH/POST. Ретрай – на всю пачку
+        (повтор идемпотентен: уже созданные записи найдутся и обновятся).
+        """
+        batch = dict(records)   # дубликаты msg_id в пачке: побеждает последний
+        if batch:
+            self._write_batch(collection, batch)
+
+    def _write_batch(self, collection: str, batch: Mapping[str, Mapping[str, Any]]) -> None:
+        """Поиск существующих записей по msg_id, затем PATCH найденных и POST новых."""
+        existing = self._find_ids(collection, list(batch))
+        for msg_id, record in batch.items():
+            rec_id = existing.get(msg_id)
+            if rec_id is not None:
+                resp = self._patch(f"/api/collections/{collection}/records/{rec_id}", json=record)
+            else:
+                resp = self._post(f"/api/collections/{collection}/records", json=record)
             resp.raise_for_status()
-            logger.info("Inserted new record into %s", collection)
-        except httpx.HTTPStatusError as exc:
-            logger.error("PocketBase insert failed: %s", exc)
-            raise  # trigger retry
+        logger.info("Upserted %d records into %s (%d patched)", len(batch), collection, len(existing))
+
+    def _find_ids(self, collection: str, msg_ids: List[str]) -> dict[str, str]:
+        """id записей по msg_id; поиск кусками по FIND_IDS_CHUNK (лимит длины filter)."""
+        found: dict[str, str] = {}
+        for i in range(0, len(msg_ids), FIND_IDS_CHUNK):
+            chunk = msg_ids[i:i + FIND_IDS_CHUNK]
+            resp = self._get(f"/api/collections/{collection}/records", params=_msg_id_filter(chunk))
+            resp.raise_for_status()
+            found.update((item["msg_id"], item["id"]) for item in resp.json().get("items", []))
+        return found
 
     def get_records_since(self, collection: str, since_pb_str: str) -> List[Mapping[str, Any]]:
         """Получает записи из коллекции, у которых поле datetime > since_pb_str."""
@@ -143,88 +286,148 @@ class AsyncPocketBaseClient(PocketBaseClient):
     Inherits from the sync client and overrides methods to be async.
     """
 
-    def __init__(self, *, base_url: str, email: str, password: str) -> None:
+    PAGE_CONCURRENCY = 16   # параллельных запросов страниц в get_records_since
+
+    def __init__(
+        self,
+        *,
+        base_url: str,
+        email: str,
+        password: str,
+        limits: httpx.Limits | None = None,
+        unique_msg_id: bool | None = None,
+    ) -> None:
         # Не вызываем super().__init__() напрямую, чтобы не создавать лишний sync клиент.
         # Вместо этого, инициализируем атрибуты вручную.
         self._base_url = base_url.rstrip("/")
         self._email = email
         self._password = password
         # Создаем AsyncClient
-        self._client = httpx.AsyncClient(base_url=self._base_url, timeout=10.0)
+        # HTTP/2 мультиплексирует параллельные PATCH/POST пачки в одном
+        # TCP+TLS-соединении; включается настройкой PB_HTTP2.
+        self._client = httpx.AsyncClient(
+            base_url=self._base_url,
+            timeout=10.0,
+            limits=limits or _pool_limits(),
+            http2=get_settings().pb_http2,
+        )
         self._token: str | None = None
+        self._unique_msg_id = _unique_msg_id(unique_msg_id)
 
     # ------------------------------------------------------------- low level
     async def _get(self, path: str, **kwargs: Any) -> httpx.Response:
         return await self._client.get(path, **kwargs)
 
     async def _post(self, path: str, **kwargs: Any) -> httpx.Response:
-        return await self._client.post(path, **kwargs)
+        return await self._client.post(path, **_json_body(kwargs))
 
     async def _patch(self, path: str, **kwargs: Any) -> httpx.Response:
-        return await self._client.patch(path, **kwargs)
+        return await self._client.patch(path, **_json_body(kwargs))
 
     # -------------------------------------------------------------- business
 
-    @retry(wait=wait_exponential(multiplier=1, min=2, max=30), stop=stop_after_attempt(5))
+    @_retry_pb
     async def upsert(self, collection: str, record: Mapping[str, Any], *, msg_id: str) -> None:
-        """Create or update a record guaranteeing *idempotency* by *msg_id*."""
-        filter_param = {
-            "filter": f"msg_id='{msg_id}'",
-            "page": 1,
-            "perPage": 1,
-        }
-        try:
-            # Используем `await` для вызова асинхронных версий
-            resp = await self._get(f"/api/collections/{collection}/records", params=filter_param)
-            resp.raise_for_status()
-            items = resp.json().get("items", [])
-            if items:
-                rec_id = items[0]["id"]
-                resp = await self._patch(
-                    f"/api/collections/{collection}/records/{rec_id}",
-                    json=record,
-                )
+        """
+        Create or update a record guaranteeing *idempotency* by *msg_id*.
+
+        С UNIQUE-индексом по ``msg_id`` (``PB_UNIQUE_MSG_ID``) запись создаётся
+        оптимистично (новые SMS – основной случай, это один запрос вместо
+        поиска + записи): индекс отклоняет дубликат с 400, и только тогда ищем
+        запись и делаем PATCH. Без индекса – поиск, затем PATCH/POST.
+        """
+        if not self._unique_msg_id:
+            await self._write_batch(collection, {msg_id: record})
+            return
+        resp = await self._post(f"/api/collections/{collection}/records", json=record)
+        if not _is_duplicate_msg_id(resp):
+            try:
                 resp.raise_for_status()
-                logger.info("Patched existing record %s in %s", rec_id, collection)
-                return
-        except httpx.HTTPStatusError as exc:
-            logger.warning("PocketBase search failed: %s", exc)
-            raise
+            except httpx.HTTPStatusError as exc:
+                logger.error("PocketBase insert failed: %s", exc)
+                raise  # let tenacity retry
+            logger.info("Inserted new record into %s", collection)
+            return
 
         try:
-            resp = await self._post(f"/api/collections/{collection}/records", json=record)
+            rec_id = (await self._find_ids(collection, [msg_id]))[msg_id]
+            resp = await self._patch(f"/api/collections/{collection}/records/{rec_id}", json=record)
             resp.raise_for_status()
-            logger.info("Inserted new record into %s", collection)
-        except httpx.HTTPStatusError as exc:
-            logger.error("PocketBase insert failed: %s", exc)
-            raise
+            logger.info("Patched existing record %s in %s", rec_id, collection)
+        except (httpx.HTTPStatusError, KeyError) as exc:
+            logger.warning("PocketBase update failed: %s", exc)
+            raise  # let tenacity retry
+
+    @_retry_pb
+    async def upsert_many(self, collection: str, records: List[tuple[str, Mapping[str, Any]]]) -> None:
+        """
+        Batch-версия :meth:`upsert`: один поиск по всем *msg_id* пачки, затем
+        PATCH/POST всех записей параллельно (asyncio.gather). Ретрай – на всю
+        пачку (повтор идемпотентен: уже созданные записи найдутся и обновятся).
+        """
+        batch = dict(records)   # дубликаты msg_id в пачке: побеждает последний
+        if batch:
+            await self._write_batch(collection, batch)
+
+    async def _write_batch(  # type: ignore[override]
+        self, collection: str, batch: Mapping[str, Mapping[str, Any]]
+    ) -> None:
+        """Поиск существующих записей по msg_id, затем параллельные PATCH/POST."""
+        existing = await self._find_ids(collection, list(batch))
+
+        async def _write(msg_id: str, record: Mapping[str, Any]) -> None:
+            rec_id = existing.get(msg_id)
+            if rec_id is not None:
+                resp = await self._patch(f"/api/collections/{collection}/records/{rec_id}", json=record)
+            else:
+                resp = await self._post(f"/api/collections/{collection}/records", json=record)
+            resp.raise_for_status()
+
+        await asyncio.gather(*(_write(msg_id, record) for msg_id, record in batch.items()))
+        logger.info("Upserted %d records into %s (%d patched)", len(batch), collection, len(existing))
+
+    async def _find_ids(self, collection: str, msg_ids: List[str]) -> dict[str, str]:  # type: ignore[override]
+        """id записей по msg_id; куски по FIND_IDS_CHUNK запрашиваются параллельно."""
+        async def _chunk(chunk: List[str]) -> list[Mapping[str, Any]]:
+            resp = await self._get(f"/api/collections/{collection}/records", params=_msg_id_filter(chunk))
+            resp.raise_for_status()
+            return resp.json().get("items", [])
+
+        pages = await asyncio.gather(*(
+            _chunk(msg_ids[i:i + FIND_IDS_CHUNK]) for i in range(0, len(msg_ids), FIND_IDS_CHUNK)
+        ))
+        return {item["msg_id"]: item["id"] for items in pages for item in items}
 
     async def get_records_since(self, collection: str, since_pb_str: str) -> List[Mapping[str, Any]]:
-        """Получает записи из коллекции, у которых поле datetime > since_pb_str."""
-        items: list[Mapping[str, Any]] = []
-        page = 1
+        """
+        Получает записи из коллекции, у которых поле datetime > since_pb_str.
+
+        Первая страница сообщает totalPages, остальные запрашиваются
+        параллельно (не больше PAGE_CONCURRENCY запросов) и склеиваются по порядку.
+        """
         per_page = 500
         flt = f"datetime > '{since_pb_str}'"
         logger.info(f"PB: Выполняется запрос с фильтром: {flt}")
+        limit = asyncio.Semaphore(self.PAGE_CONCURRENCY)
 
-        while True:
+        async def _page(page: int) -> Mapping[str, Any]:
             params = {
                 "page": page,
                 "perPage": per_page,
                 "sort": "datetime",
                 "filter": flt,
             }
-            # Используем `await`
-            resp = await self._client.get(f"/api/collections/{collection}/records", params=params)
+            async with limit:
+                resp = await self._client.get(f"/api/collections/{collection}/records", params=params)
             resp.raise_for_status()
-            data = resp.json()
-            batch = data.get("items", [])
-            if not batch:
-                break
-            items.extend(batch)
-            if data["page"] >= data["totalPages"]:
-                break
-            page += 1
+            return resp.json()
+
+        first = await _page(1)
+        items: list[Mapping[str, Any]] = list(first.get("items", []))
+        if items and first["page"] < first["totalPages"]:
+            rest = await asyncio.gather(*(_page(p) for p in range(2, first["totalPages"] + 1)))
+            for data in rest:
+                items.extend(data.get("items", []))
         logger.info(f"PB: получено {len(items)} новых записей.")
         return items
 
@@ -244,25 +447,26 @@ class AsyncPocketBaseClient(PocketBaseClient):
 # ---------------------------------------------------------------------------
 
 
-@lru_cache(maxsize=1)
-def get_pb_client() -> PocketBaseClient:
-    """Return singleton PocketBaseClient configured from *libs.config*."""
-    settings = get_settings()
-    return PocketBaseClient(
-        base_url=settings.pb_url,
-        email=settings.pb_email,
-        password=settings.pb_password,
-    )
+# Глобальная переменная для хранения экземпляра; lock – на случай первого
+# обращения сразу из нескольких потоков (sync-клиент используют скрипты).
+_pb_client: Optional[PocketBaseClient] = None
+_pb_client_lock = threading.Lock()
+
 
-@lru_cache(maxsize=1)
 def get_pb_client() -> PocketBaseClient:
     """Return singleton PocketBaseClient configured from *libs.config*."""
-    settings = get_settings()
-    return PocketBaseClient(
-        base_url=settings.pb_url,
-        email=settings.pb_email,
-        password=settings.pb_password,
-    )
+    global _pb_client
+    if _pb_client is None:
+        with _pb_client_lock:
+            if _pb_client is None:
+                settings = get_settings()
+                _pb_client = PocketBaseClient(
+                    base_url=settings.pb_url,
+                    email=settings.pb_email,
+                    password=settings.pb_password,
+                )
+    return _pb_client
+
 
 # Глобальная переменная для хранения экземпляра
 _async_pb_client: Optional[AsyncPocketBaseClient] = None
@@ -289,25 +493,36 @@ COLLECTION_DEBIT: Literal["sms_data"] = "sms_data"
 COLLECTION_CREDIT: Literal["transactions"] = "transactions"
 
 
-async def upsert_parsed_sms(parsed_sms: ParsedSMS) -> None:  # noqa: D401
-    """Upsert *parsed_sms* into the appropriate PocketBase collection."""
-    client = await get_async_pb_client()
+def _to_record(parsed_sms: ParsedSMS) -> dict[str, Any]:
+    """
+    ParsedSMS → запись коллекции PocketBase.
 
-    record: dict[str, Any] = {
+    Литерал dict здесь быстрее ``model_dump(mode="json")`` (~2 мкс против ~5
+    на запись): сериализатору pydantic приходится обходить всю схему модели.
+    """
+    amount, balance = parsed_sms.amount, parsed_sms.balance
+    return {
         "msg_id": parsed_sms.msg_id,
         "original_body": parsed_sms.raw_body,
         "sender": parsed_sms.sender,
         "datetime": parsed_sms.date.isoformat(),
         "card": parsed_sms.card,
-        "amount": str(parsed_sms.amount),
+        "amount": str(amount) if amount is not None else None,
         "currency": parsed_sms.currency,
-        "balance": str(parsed_sms.balance) if parsed_sms.balance is not None else None,
+        "balance": str(balance) if balance is not None else None,
         "merchant": parsed_sms.merchant,
         "address": parsed_sms.address,
         "city": parsed_sms.city,
         "txn_type": parsed_sms.txn_type,
     }
 
+
+async def upsert_parsed_sms(parsed_sms: ParsedSMS) -> None:  # noqa: D401
+    """Upsert *parsed_sms* into the appropriate PocketBase collection."""
+    client = await get_async_pb_client()
+
+    record = _to_record(parsed_sms)
+
     collection = COLLECTION_DEBIT
 
     try:
@@ -316,3 +531,18 @@ async def upsert_parsed_sms(parsed_sms: ParsedSMS) -> None:  # noqa: D401
         logger.error("PocketBase upsert gave up: %s", exc)
         sentry_capture(exc, extras={"record": record})
         raise
+
+
+async def upsert_parsed_sms_many(parsed: List[ParsedSMS]) -> None:
+    """Upsert пачки ParsedSMS: один поиск на пачку вместо поиска на каждую SMS."""
+    if not parsed:
+        return
+    client = await get_async_pb_client()
+    records = [(p.msg_id, _to_record(p)) for p in parsed]
+
+    try:
+        await client.upsert_many(COLLECTION_DEBIT, records)
+    except RetryError as exc:  # after several attempts
+        logger.error("PocketBase batch upsert gave up: %s", exc)
+        sentry_capture(exc, extras={"msg_ids": [msg_id for msg_id, _ in records]})
+        raise
@@ -23,16 +23,52 @@ except Exception as e:
 from __future__ import annotations
 
 import os
+import threading
+import time
 from functools import lru_cache
 from types import TracebackType
 from typing import Any, Mapping, MutableMapping, Optional, Type
 
 import sentry_sdk
-from sentry_sdk import Hub
 
 from libs.config import get_settings
 
 
+# ---------------------------------------------------------------------------
+# Rate limiting
+# ---------------------------------------------------------------------------
+
+
+class _TokenBucket:
+    """Не больше *rate* событий в минуту с запасом *burst* (для before_send)."""
+
+    def __init__(self, rate_per_minute: float, burst: int) -> None:
+        self._rate = rate_per_minute / 60.0
+        self._burst = float(burst)
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()   # before_send зовётся из разных потоков
+
+    def allow(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            if self._tokens < 1.0:
+                return False
+            self._tokens -= 1.0
+            return True
+
+
+def _make_before_send(bucket: _TokenBucket):
+    # Лавина одинаковых ошибок (например, PocketBase недоступен) не должна
+    # занимать транспорт и квоту Sentry – лишние события просто отбрасываем.
+    def _before_send(event: dict, hint: dict) -> dict | None:
+        return event if bucket.allow() else None
+
+    return _before_send
+
+
 # ---------------------------------------------------------------------------
 # Public API
 # ---------------------------------------------------------------------------
@@ -60,9 +96,16 @@ def init_sentry(*, release: str | None = None, env: str | None = None) -> None:
         dsn=dsn,
         release=release,
         environment=env or getattr(settings, "env", "local"),
-        traces_sample_rate=float(os.getenv("SENTRY_TRACES_SAMPLE_RATE", "1.0")),
-        profile_session_sample_rate=float(os.getenv("SENTRY_PROFILE_SAMPLE_RATE", "1.0")),
+        # Трассировки и профили – выборочно: полный профиль на каждый запрос
+        # в проде не нужен. Для отладки поднимите переменные окружения до 1.0.
+        traces_sample_rate=float(os.getenv("SENTRY_TRACES_SAMPLE_RATE", "0.01")),
+        profile_session_sample_rate=float(os.getenv("SENTRY_PROFILE_SAMPLE_RATE", "0.01")),
         max_value_length=4_096,  # guard against huge events
+        max_breadcrumbs=20,
+        send_default_pii=False,
+        before_send=_make_before_send(
+            _TokenBucket(float(os.getenv("SENTRY_MAX_EVENTS_PER_MINUTE", "60")), burst=20)
+        ),
     )
 
 
@@ -76,12 +119,15 @@ def sentry_capture(exc: BaseException, *, extras: Optional[dict[str, Any]] = Non
     extras
         Extra key/value pairs to attach to the event (e.g. raw SMS body).
     """
-    client = Hub.current.client
-    if client is None:  # SDK not initialised
+    if not sentry_sdk.get_client().is_active():  # SDK not initialised
+        return
+
+    if not extras:
+        # Без extras отдельный scope не нужен
+        sentry_sdk.capture_exception(exc)
         return
 
-    with sentry_sdk.push_scope() as scope:  # type: ignore[attr-defined]
-        if extras:
-            for key, value in extras.items():
-                scope.set_extra(key, value)
-        sentry_sdk.capture_exception(exc)  # type: ignore[attr-defined]
+    with sentry_sdk.new_scope() as scope:
+        for key, value in extras.items():
+            scope.set_extra(key, value)
+        sentry_sdk.capture_exception(exc)
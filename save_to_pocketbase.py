@@ -10,12 +10,16 @@
 
 import os
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Set
 
+import httpx
 from diskcache import Cache
 from pocketbase import 
 
+from libs.pocketbase import FIND_IDS_CHUNK, _quote
+
 # --- Настройка логирования ---------------------------------------------------
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -28,11 +32,27 @@ PB_PASSWORD = os.environ.get("PB_PASSWORD", None)
 PURCHASE_CACHE_DIR = "parsed_sms_cache"   # дебет (покупки/списания)
 CREDIT_CACHE_DIR   = "credit_sms_cache"   # кредит (зачисления)
 
+# Ключей в одном фильтре проверки дубликатов: PocketBase 0.23+ режет filter
+# длиннее ~3500 символов, берём тот же размер куска, что и pb_writer.
+DUP_CHECK_CHUNK = FIND_IDS_CHUNK
+CREATE_WORKERS  = 8     # параллельных create-запросов (= размер пула соединений)
+
 # --- Карта кэш -> коллекция + трансформер ------------------------------------
 # Функция-трансформер получает запись из кэша и возвращает payload для PB
 
 def _dt_str(date: str, time_: str) -> Optional[str]:
     """Преобразует d.m.Y + HH:MM в формат YYYY-MM-DD HH:MM:SS"""
+    # Быстрый путь для обычного DD?MM?YY(YY) + HH:MM: срезы и int() вместо
+    # перебора до шести форматов strptime (каждая неудача – несколько мкс).
+    if len(date) in (8, 10) and date[2] == date[5] and date[2] in "./-" and len(time_) == 5 and time_[2] == ":":
+        try:
+            year = int(date[6:])
+            if len(date) == 8:
+                year += 1900 if year >= 69 else 2000   # как у %y
+            dt = datetime(year, int(date[3:5]), int(date[:2]), int(time_[:2]), int(time_[3:]))
+            return f"{dt.year:04d}-{dt.month:02d}-{dt.day:02d} {dt.hour:02d}:{dt.minute:02d}:00"
+        except ValueError:
+            pass  # нестандартная строка – пусть разбирает strptime
     for fmt in ("%d.%m.%Y", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%y", "%d/%m/%y", "%d-%m-%y"):
         try:
             dt = datetime.strptime(f"{date} {time_}", f"{fmt} %H:%M")
@@ -80,10 +100,12 @@ def _build_transactions(record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
 SYNC_MAP = {
     PURCHASE_CACHE_DIR: {
         "collection": "sms_data",
+        "key_field":  "msg_id",
         "builder":    _build_sms_data,
     },
     CREDIT_CACHE_DIR: {
         "collection": "transactions",
+        "key_field":  "transaction_id",
         "builder":    _build_transactions,
     },
 }
@@ -100,6 +122,21 @@ def _login(client: PocketBase):
             logging.warning("Не удалось войти админом: %s. Продолжаем без авторизации.", e)
 
 
+def _existing_keys(collection, key_field: str, keys: List[str]) -> Set[str]:
+    """Какие из *keys* уже есть в коллекции.
+
+    Один get_list на DUP_CHECK_CHUNK ключей (`k='a' || k='b' ...`) вместо
+    отдельного запроса на каждую запись.
+    """
+    existing: Set[str] = set()
+    for i in range(0, len(keys), DUP_CHECK_CHUNK):
+        chunk = keys[i:i + DUP_CHECK_CHUNK]
+        flt = " || ".join(f"{key_field}={_quote(k)}" for k in chunk)
+        page = collection.get_list(1, len(chunk), {"filter": flt, "fields": key_field})
+        existing.update(getattr(item, key_field) for item in page.items)
+    return existing
+
+
 def sync_cache(cache_dir: str, config: Dict[str, Any], client: PocketBase):
     """Синхронизирует один кэш с одной коллекцией."""
     collection = client.collection(config["collection"])
@@ -110,6 +147,8 @@ def sync_cache(cache_dir: str, config: Dict[str, Any], client: PocketBase):
     with Cache(cache_dir) as cache:
         keys = list(cache)
         logging.info("Кэш %s: найдено %d записей.", cache_dir, len(keys))
+
+        pending: List[tuple[Any, Dict[str, Any]]] = []
         for key in keys:
             rec = cache.get(key)
             # пропуск уже синхронизированных
@@ -117,46 +156,65 @@ def sync_cache(cache_dir: str, config: Dict[str, Any], client: PocketBase):
                 skipped += 1
                 continue
 
-            msg_id = rec.get("msg_id")
-            if not msg_id:
+            if not rec.get("msg_id"):
                 logging.warning("Отсутствует msg_id для %s", key)
                 errors += 1
                 continue
+            pending.append((key, rec))
 
-            # Дедупликация в PB
-            try:
-                dup = collection.get_list(query_params={"filter": f'msg_id="{msg_id}"'}) if "sms_data" == config["collection"] else collection.get_list(query_params={"filter": f'transaction_id="{msg_id}"'})
-                if dup.total_items:
-                    rec["status"] = "synced"
-                    cache.set(key, rec)
-                    skipped += 1
-                    continue
-            except Exception as e:
-                logging.error("Ошибка запроса к PocketBase: %s", e)
-                errors += 1
+        # Дедупликация в PB – пачками, а не запросом на каждую запись
+        try:
+            existing = _existing_keys(collection, config["key_field"], [rec["msg_id"] for _, rec in pending])
+        except Exception as e:
+            logging.error("Ошибка запроса к PocketBase: %s", e)
+            errors += len(pending)
+            pending = []
+            existing = set()
+
+        done: List[tuple[Any, Dict[str, Any]]] = []
+        to_create: List[tuple[Any, Dict[str, Any], Dict[str, Any]]] = []
+        for key, rec in pending:
+            if rec["msg_id"] in existing:
+                done.append((key, rec))
+                skipped += 1
                 continue
 
             payload = build(rec)
             if not payload:
                 errors += 1
                 continue
+            to_create.append((key, rec, payload))
+
+        # Сохраняем: запросы параллельно через общий keep-alive клиент SDK
+        with ThreadPoolExecutor(CREATE_WORKERS) as pool:
+            futures = {pool.submit(collection.create, payload): (key, rec) for key, rec, payload in to_create}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    logging.error("Ошибка создания записи в PB: %s", e)
+                    errors += 1
+                    continue
+                done.append(futures[future])
+                synced += 1
 
-            # Сохраняем
-            try:
-                collection.create(payload)
+        # Статусы – одной транзакцией SQLite
+        with cache.transact():
+            for key, rec in done:
                 rec["status"] = "synced"
                 cache.set(key, rec)
-                synced += 1
-            except Exception as e:
-                logging.error("Ошибка создания записи в PB: %s", e)
-                errors += 1
 
     logging.info("%s => %s | синхр: %d, пропущено: %d, ошибки: %d", cache_dir, config["collection"], synced, skipped, errors)
 
 # -----------------------------------------------------------------------------
 
 if __name__ == "__main__":
-    client = PocketBase(PB_URL)
+    # Один httpx.Client на все запросы: TCP/TLS-соединения переиспользуются
+    # потоками ThreadPoolExecutor (httpx.Client потокобезопасен).
+    http_client = httpx.Client(
+        limits=httpx.Limits(max_connections=CREATE_WORKERS, max_keepalive_connections=CREATE_WORKERS),
+    )
+    client = PocketBase(PB_URL, http_client=http_client)
     _login(client)
 
     for cdir, cfg in SYNC_MAP.items():
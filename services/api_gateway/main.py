@@ -27,7 +27,6 @@ from libs.nats_utils import publish_raw_sms, get_nats_connection
 from libs.sentry import sentry_capture
 from schemas import RawSMSPayload
 from pathlib import Path
-from libs.config import get_settings
 
 # ---------------------------------------------------------------------------#
 # Graceful shutdown helpers (optional)                                       #
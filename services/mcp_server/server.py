@@ -105,7 +105,6 @@ from mcp.server.fastmcp import FastMCP
 from fastapi import FastAPI
 import datetime
 from libs.sentry import sentry_capture
-from libs.config import get_settings
 
 
 # Создаём объект-сервер
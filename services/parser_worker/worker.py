@@ -16,17 +16,21 @@ from typing import Any
 
 from nats.aio.client import Client as NATS
 from nats.aio.msg import Msg
+from nats.errors import TimeoutError as NatsTimeoutError
 from libs.config import get_settings
 from libs.models import ParsedSMS, RawSMS
 from libs.nats_utils import (
     SUBJECT_PROCESSING,
     get_nats_connection,
     ensure_stream,
+    ensure_stream_once,
+    get_jetstream,
+    model_to_bytes,
     SUBJECT_RAW,
     SUBJECT_PARSED,
     SUBJECT_FAILED,
 )
-from libs.gemini_parser import BrokenMessage, parse_sms_llm
+from libs.gemini_parser import BrokenMessage, parse_sms_llm, parse_sms_llm_batch
 from libs.sentry import init_sentry, sentry_capture
 
 # Вспомогательные функции для условного использования Sentry
@@ -65,128 +69,205 @@ from metrics import (
 )
 
 logger = logging.getLogger("parser_worker")
+
+# Пачка для Gemini: до BATCH_SIZE сообщений или BATCH_WAIT секунд ожидания
+BATCH_SIZE = int(os.getenv("PARSER_BATCH_SIZE", "16"))
+BATCH_WAIT = float(os.getenv("PARSER_BATCH_WAIT", "0.2"))
+
 logging.basicConfig(level=logging.DEBUG, format="%(asctime)s %(levelname)s %(message)s")
 
+# Сообщения, которые не отправляем в LLM (коды, отказы, переводы между людьми).
+# Сравнение без учёта регистра, кроме 'Daily limit exceeded'.
+_SKIP_MARKERS_UPPER = (
+    'OTP', 'CODE:', 'NOT ENOUGH FUNDS', 'INSUFFICIENT FUNDS', 'CREDIT PAYMENT',
+    'C2C RECEIVED', 'PASS:', 'PASS=', 'PERSON TO PERSON',
+)
+
+
+def _is_skipped_sms(body: str) -> bool:
+    # upper() – один раз на сообщение; цикл по `in` (C-шный fastsearch) на длине
+    # SMS быстрее и any(), и альтернации re, и автомата Ахо–Корасик из Python.
+    if 'Daily limit exceeded' in body:
+        return True
+    upper = body.upper()
+    for marker in _SKIP_MARKERS_UPPER:
+        if marker in upper:
+            return True
+    return False
+
+
 # ---------------------------------------------------------------------------
 # Core processing logic
 # ---------------------------------------------------------------------------
 
-async def _process_one(
-    nc: NATS,
+async def _validate_raw(js, msg: Msg) -> RawSMS | None:
+    """Декодирует и валидирует сырое сообщение; невалидное уходит в DLQ."""
+    logger.debug("⏱  V: start-validate %s", msg.metadata.sequence)
+    with _start_span_if_enabled(name="validate"):
+        try:
+            logger.info(f"Обрабатываем сообщение {msg}")
+            if isinstance(msg.data, bytes):
+                # Данный блок обработки для сообщений из DLQ
+                msg.data = msg.data.decode()
+                raw_sms_data = json.loads(msg.data)
+                if 'raw' in raw_sms_data:
+                    raw_sms_data = raw_sms_data['raw']
+            else:
+                # Декодируем и валидируем сырое сообщение
+                raw_sms_data = json.loads(msg.data)
+            raw_sms = RawSMS(**raw_sms_data)
+            logger.debug("✅  V: ok %s", msg.metadata.sequence)
+            return raw_sms
+        except Exception as err:
+            logger.error("❌  V: fail %s – %s", msg.metadata.sequence, err)
+            logger.error("Ошибка валидации сообщения: %s. Данные: %s", err, msg.data)
+            # Некорректная схема — сразу в DLQ
+            failure_payload = json.dumps({"err": str(err), "entry": msg.data.decode(errors='ignore')}).encode()
+            await js.publish(SUBJECT_FAILED, failure_payload)
+            PARSED_FAIL.inc()
+            sentry_capture(err, extras={"raw_data": msg.data.decode(errors='ignore')})
+            await msg.ack()
+            return None
+
+
+async def _handle_parsed(
+    js,
     msg: Msg,
+    raw_sms: RawSMS,
+    parsed: ParsedSMS | None | BaseException,
 ) -> None:
-    """Parse *one* Raw SMS from a NATS message and publish the result."""
-    
+    """Публикует результат разбора одного SMS (или отправляет его в DLQ)."""
+    if isinstance(parsed, BrokenMessage):
+        logger.error("Сообщение пропущено: %s. SMS: %s", parsed, raw_sms)
+        PARSED_SKIP.inc()
+        await msg.ack()
+        return
+    if isinstance(parsed, Exception):
+        err = parsed
+        logger.error("❌  P: fail %s – %s", msg.metadata.sequence, err)
+        logger.error("Ошибка парсинга SMS: %s. SMS: %s", err, raw_sms)
+        failure_payload = json.dumps({"err": str(err), "entry": raw_sms.model_dump()}).encode()
+        await js.publish(SUBJECT_FAILED, failure_payload)
+        PARSED_FAIL.inc()
+        sentry_capture(err, extras={"raw_sms": raw_sms.model_dump()})
+        await msg.ack()
+        return
+    if isinstance(parsed, BaseException):
+        # CancelledError и т.п. – не ошибка разбора, пробрасываем
+        raise parsed
+    logger.debug("✅  P: ok %s", msg.metadata.sequence)
+
+    if parsed is None:
+        # Нераспознанный формат – в DLQ без stacktrace
+        logger.warning("Не удалось распознать SMS → DLQ: %s", raw_sms.body[:60])
+        failure_payload = json.dumps({"reason": "unmatched", "raw": raw_sms.model_dump()}).encode()
+        await js.publish(SUBJECT_FAILED, failure_payload)
+        PARSED_FAIL.inc()
+        await msg.ack()
+        return
+
+    # Успешный парсинг: обогащаем и публикуем
+    with _start_span_if_enabled(name="validate_parsed"):
+        try:
+            parsed_sms = ParsedSMS(**parsed.model_dump())
+        except Exception as err:
+            failure_payload = json.dumps({"err": str(err), "entry": msg.data.decode(errors='ignore')}).encode()
+            sentry_capture(err, extras={"raw_data": msg.data.decode(errors='ignore')})
+            await js.publish(SUBJECT_FAILED, failure_payload)
+            PARSED_FAIL.inc()
+            await msg.ack()
+            return
+    with _start_span_if_enabled(name="publish"):
+        if not isinstance(parsed_sms.date, datetime):
+            logger.warning("Не считалась дата: %s", raw_sms.body[:60])
+        if parsed.date > datetime.now():
+            logger.error(f"Дата больше чем сегодня: {parsed.date}")
+            failure_payload = json.dumps({"err": str("Дата больше чем сегодня"), "entry": msg.data.decode(errors='ignore')}).encode()
+            sentry_capture(Exception("Дата больше чем текущая"), extras={"raw_data": msg.data.decode(errors='ignore')})
+            await js.publish(SUBJECT_FAILED, failure_payload)
+            PARSED_FAIL.inc()
+            await msg.ack()
+        else:
+            logger.info(f"Start publish: {raw_sms.body[:120]}")
+            success_payload = model_to_bytes(parsed_sms)
+            await js.publish(SUBJECT_PARSED, success_payload)
+            await js.publish(SUBJECT_PROCESSING, success_payload)
+            PARSED_OK.inc()
+            logger.info("Успешно обработано: %s", raw_sms.body[:120])
+            logger.debug("Сообщение: %s", success_payload)
+            await msg.ack()
+
+
+async def _parse_timed(raw_sms: RawSMS) -> ParsedSMS | None:
+    """parse_sms_llm с метриками времени на одно сообщение (а не на пачку)."""
+    with PROCESSING_TIME.time(), GEMINI_LATENCY.time():
+        return await parse_sms_llm(raw_sms)
+
+
+async def _process_batch(
+    nc: NATS,
+    msgs: list[Msg],
+) -> None:
+    """
+    Parse a batch of Raw SMS from NATS and publish the results.
+
+    Промахи кеша уходят в Gemini параллельно (`parse_sms_llm_batch`),
+    ошибка одного сообщения не мешает остальным.
+    """
     with _start_transaction_if_enabled(op="task", name="process_parsing"):
         with _start_span_if_enabled(name="check_stream"):
-            js = nc.jetstream()
-
-            await ensure_stream(nc)
-
-        logger.debug("⏱  V: start-validate %s", msg.metadata.sequence)
-        with _start_span_if_enabled(name="validate"):
-            try:
-                logger.info(f"Обрабатываем сообщение {msg}")
-                if isinstance(msg.data, bytes):
-                    # Данный блок обработки для сообщений из DLQ
-                    msg.data = msg.data.decode()
-                    raw_sms_data = json.loads(msg.data)
-                    if 'raw' in raw_sms_data:
-                        raw_sms_data = raw_sms_data['raw']
-                else:
-                    # Декодируем и валидируем сырое сообщение
-                    raw_sms_data = json.loads(msg.data)
-                raw_sms = RawSMS(**raw_sms_data)
-                logger.debug("✅  V: ok %s", msg.metadata.sequence)
-            except Exception as err:
-                logger.error("❌  V: fail %s – %s", msg.metadata.sequence, err)
-                logger.error("Ошибка валидации сообщения: %s. Данные: %s", err, msg.data)
-                # Некорректная схема — сразу в DLQ
-                failure_payload = json.dumps({"err": str(err), "entry": msg.data.decode(errors='ignore')}).encode()
-                await js.publish(SUBJECT_FAILED, failure_payload)
-                PARSED_FAIL.inc()
-                sentry_capture(err, extras={"raw_data": msg.data.decode(errors='ignore')})
+            js = get_jetstream(nc)
+
+            await ensure_stream_once(nc)
+
+        todo: list[tuple[Msg, RawSMS]] = []
+        for msg in msgs:
+            raw_sms = await _validate_raw(js, msg)
+            if raw_sms is None:
+                continue
+            if _is_skipped_sms(raw_sms.body):
+                logger.info("Сообщение OTP типа.")
+                PARSED_OK.inc()
                 await msg.ack()
-                return
-
-        if 'OTP' in raw_sms.body.upper() or \
-                'CODE:' in raw_sms.body.upper() or \
-                'NOT ENOUGH FUNDS' in raw_sms.body.upper() or \
-                'INSUFFICIENT FUNDS' in raw_sms.body.upper() or \
-                'CREDIT PAYMENT' in raw_sms.body.upper() or \
-                'C2C RECEIVED' in raw_sms.body.upper() or \
-                'PASS:' in raw_sms.body.upper() or \
-                'PASS=' in raw_sms.body.upper() or \
-                'Daily limit exceeded' in raw_sms.body or \
-                'PERSON TO PERSON' in raw_sms.body.upper():
-            logger.info("Сообщение OTP типа.")
-            PARSED_OK.inc()
-            await msg.ack()
-            logger.info("Сообщение пропущено.")
-            return 
+                logger.info("Сообщение пропущено.")
+                continue
+            todo.append((msg, raw_sms))
+        if not todo:
+            return
 
-        logger.info("Начинаем парсинг с LLM")
+        logger.info("Начинаем парсинг с LLM: %d SMS", len(todo))
         # Основная логика парсинга
         with _start_span_if_enabled(name="parsing"):
-            with PROCESSING_TIME.time():
-                try:
-                    with GEMINI_LATENCY.time():
-                        parsed = parse_sms_llm(raw_sms)
-                        logger.debug("✅  P: ok %s", msg.metadata.sequence)
-                except BrokenMessage as err:
-                    logger.error("Сообщение пропущено: %s. SMS: %s", err, raw_sms)
-                    PARSED_SKIP.inc()
-                    await msg.ack()
-                    return
-                except Exception as err:
-                    logger.error("❌  P: fail %s – %s", msg.metadata.sequence, err)
-                    logger.error("Ошибка парсинга SMS: %s. SMS: %s", err, raw_sms)
-                    failure_payload = json.dumps({"err": str(err), "entry": raw_sms.model_dump()}).encode()
-                    await js.publish(SUBJECT_FAILED, failure_payload)
-                    PARSED_FAIL.inc()
-                    sentry_capture(err, extras={"raw_sms": raw_sms.model_dump()})
-                    await msg.ack()
-                    return
-                    
-                if parsed is None:
-                    # Нераспознанный формат – в DLQ без stacktrace
-                    logger.warning("Не удалось распознать SMS → DLQ: %s", raw_sms.body[:60])
-                    failure_payload = json.dumps({"reason": "unmatched", "raw": raw_sms.model_dump()}).encode()
-                    await js.publish(SUBJECT_FAILED, failure_payload)
-                    PARSED_FAIL.inc()
-                    await msg.ack()
-                    return
-
-        # Успешный парсинг: обогащаем и публикуем
-        with _start_span_if_enabled(name="validate_parsed"):
-            try:
-                parsed_sms = ParsedSMS(**parsed.model_dump())
-            except Exception as err:
-                failure_payload = json.dumps({"err": str(err), "entry": msg.data.decode(errors='ignore')}).encode()
-                sentry_capture(err, extras={"raw_data": msg.data.decode(errors='ignore')})
-                await js.publish(SUBJECT_FAILED, failure_payload)
-                PARSED_FAIL.inc()
-                await msg.ack()
-                return
-        with _start_span_if_enabled(name="publish"):
-            if not isinstance(parsed_sms.date, datetime):
-                logger.warning("Не считалась дата: %s", raw_sms.body[:60])
-            if parsed.date > datetime.now():
-                logger.error(f"Дата больше чем сегодня: {parsed.date}")
-                failure_payload = json.dumps({"err": str("Дата больше чем сегодня"), "entry": msg.data.decode(errors='ignore')}).encode()
-                sentry_capture(Exception("Дата больше чем текущая"), extras={"raw_data": msg.data.decode(errors='ignore')})
-                await js.publish(SUBJECT_FAILED, failure_payload)
-                PARSED_FAIL.inc()
-                await msg.ack()
-            else:
-                logger.info(f"Start publish: {raw_sms.body[:120]}")
-                success_payload = parsed_sms.model_dump_json().encode()
-                await js.publish(SUBJECT_PARSED, success_payload)
-                await js.publish(SUBJECT_PROCESSING, success_payload)
-                PARSED_OK.inc()
-                logger.info("Успешно обработано: %s", raw_sms.body[:120])
-                logger.debug("Сообщение: %s", success_payload)
-                await msg.ack()
+            results = await parse_sms_llm_batch(
+                [raw_sms for _, raw_sms in todo], parse=_parse_timed
+            )
+
+        for (msg, raw_sms), parsed in zip(todo, results):
+            await _handle_parsed(js, msg, raw_sms, parsed)
+
+
+async def _process_one(
+    nc: NATS,
+    msg: Msg,
+) -> None:
+    """Parse *one* Raw SMS from a NATS message and publish the result."""
+    await _process_batch(nc, [msg])
+
+
+async def _next_batch(sub) -> list[Msg]:
+    """Ждёт первое сообщение, затем добирает пачку до BATCH_SIZE / BATCH_WAIT."""
+    msgs = [await sub.next_msg(timeout=None)]
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + BATCH_WAIT
+    while len(msgs) < BATCH_SIZE:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        try:
+            msgs.append(await sub.next_msg(timeout=remaining))
+        except NatsTimeoutError:
+            break
+    return msgs
 
 # ---------------------------------------------------------------------------
 # Main loop
@@ -203,8 +284,8 @@ async def _worker_loop(nc: NATS, consumer_group: str) -> None:  # pragma: no cov
     
     logger.info(f"Воркер запущен. Группа: '{consumer_group}'. Слушаем субъект: '{SUBJECT_RAW}'...")
     
-    async for msg in sub.messages:
-        await _process_one(nc, msg)
+    while True:
+        await _process_batch(nc, await _next_batch(sub))
 
 # ---------------------------------------------------------------------------
 # Entrypoint helpers
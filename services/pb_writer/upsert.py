@@ -4,6 +4,18 @@ from db.models import SmsData
 from db.session import SessionLocal
 from libs.sentry import sentry_capture
 
+# Строк в одном INSERT: ~15 колонок × 500 – далеко от лимита 32767 параметров asyncpg
+BULK_CHUNK_SIZE = 500
+
+
+def _to_row(parsed: dict) -> dict:
+    """Переименовывает поля ParsedSMS в колонки таблицы sms_data."""
+    fixed = parsed.copy()
+    fixed["datetime"] = fixed.pop("date", None)
+    fixed["original_body"] = fixed.pop("raw_body", None)
+    return fixed
+
+
 async def upsert_parsed_sms(parsed: dict):
     """
     Выполняет "upsert" (INSERT или UPDATE) для данных SMS.
@@ -13,21 +25,47 @@ async def upsert_parsed_sms(parsed: dict):
     try:
         async with SessionLocal() as sess:
             # Шаг 1: Создаем базовый insert-оператор
-            fixed = parsed.copy()
-            fixed["datetime"] = fixed.pop("date", None)
-            fixed["original_body"] = fixed.pop("raw_body", None)
-            insert_stmt = insert(SmsData).values(**fixed)
+            insert_stmt = insert(SmsData).values(**_to_row(parsed))
 
             # Шаг 2: Создаем финальный оператор, добавляя ON CONFLICT.
             upsert_stmt = insert_stmt.on_conflict_do_update(
                 index_elements=["msg_id"],
                 set_={
                     c.name: c
-                    for c in insert_stmt.excluded 
+                    for c in insert_stmt.excluded
                     if c.name not in ("id", "msg_id")
                 }
             )
             await sess.execute(upsert_stmt)
             await sess.commit() # Не забывайте коммитить транзакцию
     except Exception as e:
-        sentry_capture(e)
\ No newline at end of file
+        sentry_capture(e)
+
+
+async def upsert_parsed_sms_many(parsed: list[dict], chunk: int = BULK_CHUNK_SIZE) -> None:
+    """
+    Пачечный вариант `upsert_parsed_sms` с той же семантикой (ON CONFLICT
+    DO UPDATE): один многострочный INSERT на `chunk` записей в одной сессии
+    и одной транзакции вместо отдельной сессии на каждую SMS.
+    """
+    # Postgres не даёт одному INSERT … ON CONFLICT DO UPDATE задеть строку
+    # дважды – дубликаты msg_id в пачке схлопываем, побеждает последний.
+    rows = list({row["msg_id"]: row for row in map(_to_row, parsed)}.values())
+    if not rows:
+        return
+    try:
+        async with SessionLocal() as sess:
+            for i in range(0, len(rows), chunk):
+                insert_stmt = insert(SmsData).values(rows[i:i + chunk])
+                upsert_stmt = insert_stmt.on_conflict_do_update(
+                    index_elements=["msg_id"],
+                    set_={
+                        c.name: c
+                        for c in insert_stmt.excluded
+                        if c.name not in ("id", "msg_id")
+                    }
+                )
+                await sess.execute(upsert_stmt)
+            await sess.commit()
+    except Exception as e:
+        sentry_capture(e)
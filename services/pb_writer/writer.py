@@ -10,9 +10,15 @@ import socket
 import uuid
 from typing import Any
 
+from nats.errors import TimeoutError as NatsTimeoutError
 from prometheus_client import Counter, Gauge, start_http_server
 from tenacity import retry, stop_after_attempt, wait_exponential
 
+try:  # ставится вместе с uvicorn[standard]; на Windows/PyPy его нет
+    import uvloop
+except ImportError:  # pragma: no cover
+    uvloop = None
+
 from libs.config import get_settings
 from libs.models import ParsedSMS
 from libs.nats_utils import (
@@ -21,8 +27,9 @@ from libs.nats_utils import (
     SUBJECT_FAILED,
 )
 from libs.sentry import init_sentry, sentry_capture
-from libs.pocketbase import upsert_parsed_sms
+from libs.pocketbase import check_filter_value, upsert_parsed_sms, upsert_parsed_sms_many
 from upsert import upsert_parsed_sms as upsert_parsed_sms_db
+from upsert import upsert_parsed_sms_many as upsert_parsed_sms_many_db
 
 
 settings = get_settings()
@@ -41,6 +48,9 @@ METRICS_PORT = int(os.getenv("PBWRITER_METRICS_PORT", "9103"))
 # ───────────────────────────── Settings ──────────────────────────────
 STREAM_NAME = "SMS"           # тот же стрим, что использует parser_worker
 CONSUMER_DURABLE = "pb_writer"  # durable-consumer в JetStream
+# Пачка для PocketBase: до BATCH_SIZE сообщений или BATCH_WAIT секунд ожидания
+BATCH_SIZE = int(os.getenv("PBWRITER_BATCH_SIZE", "100"))
+BATCH_WAIT = float(os.getenv("PBWRITER_BATCH_WAIT", "0.5"))
 
 # ──────────────────────────── Helpers ────────────────────────────────
 async def _calc_lag(js, durable: str) -> None:
@@ -62,6 +72,31 @@ async def _safe_upsert(parsed: ParsedSMS) -> None:
     PARSED_OK.inc()
 
 
+async def _safe_upsert_many(parsed: list[ParsedSMS]) -> None:
+    """
+    Пачечный upsert: один поиск в PocketBase на пачку, в БД – один
+    многострочный INSERT … ON CONFLICT DO UPDATE.
+
+    Без своего @retry: `upsert_many` уже повторяет запросы к PocketBase, а при
+    ошибке пачка переписывается по одному через `_safe_upsert`.
+    """
+    await upsert_parsed_sms_many(parsed)
+    await upsert_parsed_sms_many_db([p.model_dump() for p in parsed])
+    PARSED_OK.inc(len(parsed))
+
+
+async def _fail(js, msg, e: Exception) -> None:
+    """Метрика + Sentry + DLQ для сообщения, которое не удалось сохранить."""
+    PARSED_FAIL.inc()
+    sentry_capture(e, extras={"raw_msg": msg.data.decode(errors="ignore")})
+    # кладём в DLQ, чтобы не потерять
+    fail_payload = json.dumps(
+        {"err": str(e), "entry": msg.data.decode(errors="ignore")}
+    ).encode()
+    await js.publish(SUBJECT_FAILED, fail_payload)
+    await msg.ack()
+
+
 async def _process_one(js, msg) -> None:
     """Обработка одного сообщения JetStream."""
     try:
@@ -71,19 +106,65 @@ async def _process_one(js, msg) -> None:
             log.info(f'Save event to pocketbase: {parsed.raw_body}')
             if parsed.date > datetime.now():
                 raise Exception("Bad date")
+            check_filter_value(parsed.msg_id)   # до ретраев: повтор не поможет
             await _safe_upsert(parsed)
         await msg.ack()
     except Exception as e:  # noqa: BLE001
-        PARSED_FAIL.inc()
-        sentry_capture(e, extras={"raw_msg": msg.data.decode(errors="ignore")})
-        # кладём в DLQ, чтобы не потерять
-        fail_payload = json.dumps(
-            {"err": str(e), "entry": msg.data.decode(errors="ignore")}
-        ).encode()
-        await js.publish(SUBJECT_FAILED, fail_payload)
+        await _fail(js, msg, e)
+
+
+async def _process_batch(js, msgs: list) -> None:
+    """
+    Обработка пачки сообщений JetStream одним batch-upsert.
+
+    Невалидные сообщения уходят в DLQ сразу; если не записалась вся пачка,
+    повторяем по одному (`_process_one`), чтобы в DLQ попали только виновные.
+    """
+    ready: list[tuple[Any, ParsedSMS]] = []
+    for msg in msgs:
+        try:
+            parsed = ParsedSMS.model_validate_json(msg.data)
+            if not parsed.merchant:
+                await msg.ack()
+                continue
+            log.info(f'Save event to pocketbase: {parsed.raw_body}')
+            if parsed.date > datetime.now():
+                raise Exception("Bad date")
+            # невалидный msg_id не должен ронять всю пачку
+            check_filter_value(parsed.msg_id)
+            ready.append((msg, parsed))
+        except Exception as e:  # noqa: BLE001
+            await _fail(js, msg, e)
+    if not ready:
+        return
+
+    try:
+        await _safe_upsert_many([parsed for _, parsed in ready])
+    except Exception as e:  # noqa: BLE001
+        log.warning("Batch upsert failed (%s), retrying one by one", e)
+        for msg, _ in ready:
+            await _process_one(js, msg)
+        return
+    for msg, _ in ready:
         await msg.ack()
 
 
+async def _next_batch(sub) -> list:
+    """Ждёт первое сообщение, затем добирает пачку до BATCH_SIZE / BATCH_WAIT."""
+    msgs = [await sub.next_msg(timeout=None)]
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + BATCH_WAIT
+    while len(msgs) < BATCH_SIZE:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        try:
+            msgs.append(await sub.next_msg(timeout=remaining))
+        except NatsTimeoutError:
+            break
+    return msgs
+
+
 async def _run() -> None:
     """Основной цикл приёмника."""
     settings = get_settings()  # noqa: F841 – понадобится, если будут ENV-флаги
@@ -105,14 +186,17 @@ async def _run() -> None:
     asyncio.create_task(_calc_lag(js, CONSUMER_DURABLE))
 
     # ── Main loop ────────────────────────────────────────────────────
-    async for msg in sub.messages:
-        await _process_one(js, msg)
+    while True:
+        await _process_batch(js, await _next_batch(sub))
 
 
 def main() -> None:  # noqa: D401
     """Entry-point — вызывается из Dockerfile CMD."""
     init_sentry(release="pb_writer@2.0.0")
-    asyncio.run(_run())
+    # Writer – это поток мелких HTTP-запросов к PB: цикл на libuv заметно
+    # дешевле стандартного selector-цикла по накладным на каждый запрос.
+    use_uvloop = uvloop is not None and os.getenv("PBWRITER_UVLOOP", "true").lower() != "false"
+    asyncio.run(_run(), loop_factory=uvloop.new_event_loop if use_uvloop else None)
 
 
 if __name__ == "__main__":
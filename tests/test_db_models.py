@@ -0,0 +1,28 @@
+from decimal import Decimal
+
+import pytest
+
+from db.models import Cents
+
+
+@pytest.mark.parametrize(
+    "value, cents",
+    [
+        (Decimal("52.00"), 5200),
+        (Decimal("391469.09"), 39146909),
+        ("27252", 2725200),
+        (1842.74, 184274),
+        (Decimal("0.005"), 1),
+        (Decimal("-12.34"), -1234),
+        (None, None),
+    ],
+)
+def test_cents_bind_param(value, cents):
+    assert Cents().process_bind_param(value, None) == cents
+
+
+def test_cents_result_value_roundtrip():
+    cents = Cents()
+    assert cents.process_result_value(5200, None) == Decimal("52.00")
+    assert str(cents.process_result_value(39146909, None)) == "391469.09"
+    assert cents.process_result_value(None, None) is None
@@ -4,6 +4,7 @@ from unittest.mock import AsyncMock, MagicMock, patch
 
 # Импортируем тестируемые функции и модели
 from libs.nats_utils import (
+    get_jetstream,
     get_nats_connection,
     publish_raw_sms,
     SUBJECT_RAW,
@@ -54,3 +55,28 @@ async def test_get_nats_connection_is_singleton(mocker):
     mock_connect.assert_called_once()  # Функция connect была вызвана только один раз
 
 
+async def test_publish_raw_sms_checks_stream_once_per_connection(sample_sms):
+    """
+    Проверяем, что stream_info уходит на сервер только при первой публикации,
+    а JetStream-контекст создаётся один раз на подключение.
+    """
+    # Arrange
+    nc = MagicMock()
+    js = nc.jetstream.return_value
+    js.stream_info = AsyncMock()
+    js.stream_info.return_value.config.subjects = [
+        "sms.raw", "sms.parsed", "sms.failed", "sms.processing", "sms.categorized",
+    ]
+    js.publish = AsyncMock(return_value="ack")
+
+    # Act
+    for _ in range(3):
+        ack = await publish_raw_sms(nc, sample_sms)
+
+    # Assert
+    assert ack == "ack"
+    js.stream_info.assert_awaited_once()
+    assert js.publish.await_count == 3
+    nc.jetstream.assert_called_once()
+    assert get_jetstream(nc) is js
+    js.publish.assert_awaited_with(SUBJECT_RAW, sample_sms.model_dump_json().encode())
@@ -1,10 +1,18 @@
 # tests/test_purchase_sale.py
 from decimal import Decimal
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
 import pytest
 
-from libs.gemini_parser import parse_sms_llm
+from libs.gemini_parser import (
+    _ResponseCache,
+    _extract_json,
+    _read_json_stream,
+    fix_broken_datetime,
+    mask_card_number_with_prefix,
+    parse_custom_datetime,
+    parse_sms_llm,
+)
 from libs.decimal_utils import parse_ambiguous_decimal
 from libs.models import ParsedSMS, RawSMS, TxnType
 
@@ -70,9 +78,10 @@ def _mk_raw(body: str) -> RawSMS:
     )
 
 
+@pytest.mark.asyncio
 @pytest.mark.parametrize("sms_body, expected", CASES)
-def test_parse_purchase_sale(sms_body: str, expected: dict):
-    result = parse_sms_llm(_mk_raw(sms_body))
+async def test_parse_purchase_sale(sms_body: str, expected: dict):
+    result = await parse_sms_llm(_mk_raw(sms_body))
 
     assert result is not None
     assert result.txn_type == TxnType.DEBIT
@@ -106,3 +115,294 @@ def test_parse_decimals():
             print(f"'{case}' -> {result} (тип: {type(result)})")
         except ValueError as e:
             print(e)
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ('79,825.89', Decimal('79825.89')),
+    ('79.825,89', Decimal('79825.89')),
+    ('79 825,89', Decimal('79825.89')),
+    ('1,234,567.89', Decimal('1234567.89')),
+    ('1.234.567,89', Decimal('1234567.89')),
+    ('123456', Decimal('123456')),
+    ('1,23', Decimal('1.23')),
+    ('999,999', Decimal('999.999')),
+    ('', Decimal('0.0')),
+])
+def test_parse_decimals_values(raw: str, expected: Decimal):
+    assert parse_ambiguous_decimal(raw) == expected
+
+
+def test_fix_broken_datetime_prefers_date_from_body():
+    current = datetime(2025, 1, 1, 20, 51)
+    body = "DEBIT ACCOUNT&#10;4083***7538,&#10;10.06.2025 20:51"
+    assert fix_broken_datetime(body, current) == datetime(2025, 6, 10, 20, 51)
+    assert fix_broken_datetime("SALE: TEST,06.05.25 14:23", current) == datetime(2025, 5, 6, 20, 51)
+    assert fix_broken_datetime("no date here", current) == current
+
+
+def test_parse_unix_timestamp_seconds_and_millis():
+    from libs.gemini_parser import parse_unix_timestamp
+
+    expected = datetime(2025, 6, 10, 20, 51)
+    assert parse_unix_timestamp(1749574260, tz="Asia/Yerevan", aware=False) == expected
+    assert parse_unix_timestamp(1749574260000, tz="Asia/Yerevan", aware=False) == expected
+    assert parse_unix_timestamp("1749574260").tzinfo is not None
+    with pytest.raises(Exception):
+        parse_unix_timestamp(-1)
+
+
+def test_mask_card_number_with_prefix():
+    assert mask_card_number_with_prefix("4083***7538, AM") == "CARD:7538, AM"
+    assert mask_card_number_with_prefix("card ***0018.") == "card ***0018."
+    otp = "Your OTP code is 123456"
+    assert mask_card_number_with_prefix(otp) is otp
+
+
+def test_parsed_sms_core_card_keeps_digits_and_allows_none():
+    from libs.llm_core import ParsedSmsCore
+
+    base = dict(
+        txn_type="debit", date=datetime(2025, 6, 10), amount="1", currency="AMD",
+        merchant=None, city=None, address=None, balance="0",
+    )
+    assert ParsedSmsCore(**base, card="*** 7538 99").card == "7538"
+    assert ParsedSmsCore(**base, card=None).card is None
+
+
+def test_extract_json_handles_clean_and_wrapped_answers():
+    assert _extract_json('{"txn_type": "debit"}') == {"txn_type": "debit"}
+    assert _extract_json('```json\n{"txn_type": "otp"}\n```') == {"txn_type": "otp"}
+    assert _extract_json("no json") is None
+
+
+@pytest.mark.asyncio
+async def test_read_json_stream_stops_after_top_level_object():
+    class _Chunk:
+        def __init__(self, text):
+            self.text = text
+
+    consumed = []
+
+    async def _stream():
+        for text in ['{"merchant": "A}{\\"B", ', None, '"city": "AM"}', "  ", "tail"]:
+            consumed.append(text)
+            yield _Chunk(text)
+
+    raw = await _read_json_stream(_stream())
+    assert _extract_json(raw) == {"merchant": 'A}{"B', "city": "AM"}
+    assert consumed[-1] == '"city": "AM"}'
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("06.05.25 14:23", datetime(2025, 5, 6, 14, 23)),
+    ("10.06.2025 20:51", datetime(2025, 6, 10, 20, 51)),
+    ("2025-06-10T20:51:00", datetime(2025, 6, 10, 20, 51)),
+    ("2025-06-10 20:51:00", datetime(2025, 6, 10, 20, 51)),
+    ("2025-06-10T20:51:00+04:00",
+     datetime(2025, 6, 10, 20, 51, tzinfo=timezone(timedelta(hours=4)))),
+])
+def test_parse_custom_datetime(value: str, expected: datetime):
+    assert parse_custom_datetime(value) == expected
+
+
+@pytest.mark.parametrize("value", [None, 1749574260, ["10.06.2025 20:51"]])
+def test_parse_custom_datetime_non_str_goes_to_dateutil(value):
+    # Не строка из JSON LLM – ошибка dateutil, а не срез/хеш в быстром пути
+    with pytest.raises(TypeError, match="Parser must be a string"):
+        parse_custom_datetime(value)
+
+
+def test_response_cache_returns_independent_copies(tmp_path):
+    rc = _ResponseCache(str(tmp_path), maxsize=1)
+    rc.set("a", {"card": "***0018"})
+    first = rc.get("a")
+    first["card"] = "0018"
+    assert rc.get("a") == {"card": "***0018"}
+    rc.set("b", {"card": "1"})          # вытесняет "a" из памяти
+    rc.flush()                          # дожидаемся фоновой записи на диск
+    assert rc.get("a") == {"card": "***0018"}   # но не с диска
+    assert rc.get("missing") is None
+
+
+@pytest.mark.asyncio
+async def test_response_cache_async_api_reads_sync_writes(tmp_path):
+    rc = _ResponseCache(str(tmp_path), maxsize=1)
+    await rc.aset("a", {"card": "***0018"})
+    rc.set("b", {"card": "1"})          # вытесняет "a" из памяти
+    rc.flush()
+    first = await rc.aget("a")          # поднимается с диска в пуле потоков
+    assert first == {"card": "***0018"}
+    first["card"] = "0018"
+    assert await rc.aget("a") == {"card": "***0018"}
+    assert rc.get("b") == {"card": "1"}
+    assert await rc.aget("missing") is None
+
+
+def test_response_cache_writes_batches_in_background(tmp_path):
+    rc = _ResponseCache(str(tmp_path))
+    for i in range(1200):               # больше двух пачек WRITE_BATCH
+        rc.set(str(i), {"n": i})
+    rc.flush()
+    assert len(rc) == 1200
+    assert _ResponseCache(str(tmp_path)).get("1199") == {"n": 1199}
+
+
+def test_response_cache_is_created_on_first_use(mocker, monkeypatch, tmp_path):
+    import libs.gemini_parser as gp
+
+    monkeypatch.chdir(tmp_path)
+    mocker.patch.object(gp, "_cache", None)
+    assert not (tmp_path / ".gemini_cache").exists()
+    first = gp._get_cache()
+    assert gp._get_cache() is first
+    assert (tmp_path / ".gemini_cache").is_dir()
+
+
+def test_response_cache_stores_json_bytes_and_reads_legacy_dicts(tmp_path):
+    import diskcache
+
+    rc = _ResponseCache(str(tmp_path))
+    rc.set("new", {"card": "***0018"})
+    rc.flush()
+    disk = diskcache.Cache(str(tmp_path))
+    assert disk["new"] == b'{"card":"***0018"}'
+    disk["old"] = {"card": "***7538"}      # запись, сделанная до перехода на bytes
+    assert _ResponseCache(str(tmp_path)).get("old") == {"card": "***7538"}
+
+
+def test_response_schema_follows_parsed_sms_core():
+    import libs.gemini_parser as gp
+    from libs.llm_core import ParsedSmsCore
+
+    schema = gp.RESPONSE_SCHEMA
+    assert list(schema.properties) == list(ParsedSmsCore.model_fields)
+    assert all(p.type == gp.types.Type.STRING for p in schema.properties.values())
+    assert schema.required == ["txn_type", "date"]
+
+
+@pytest.mark.asyncio
+async def test_call_gemini_uses_single_request_by_default(mocker):
+    import libs.gemini_parser as gp
+
+    client = mocker.patch.object(gp, "_client")
+    models = client.aio.models
+    models.generate_content = mocker.AsyncMock(return_value=mocker.Mock(text='{"txn_type": "debit"}'))
+
+    assert await gp.call_gemini([], None) == {"txn_type": "debit"}
+    models.generate_content.assert_awaited_once()
+    models.generate_content_stream.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_context_cached_config_reuses_cache_and_falls_back(mocker):
+    import libs.gemini_parser as gp
+
+    client = mocker.patch.object(gp, "_client")
+    client.aio.caches.create = mocker.AsyncMock(return_value=mocker.Mock(name="cc"))
+    client.aio.caches.create.return_value.name = "cachedContents/abc"
+
+    cc = gp._ContextCachedConfig(ttl=3600)
+    first = await cc.get()
+    assert first.cached_content == "cachedContents/abc"
+    assert first.system_instruction is None
+    assert await cc.get() is first
+    client.aio.caches.create.assert_awaited_once()
+
+    # Постоянная ошибка (модель/размер инструкции) – кеш отключается насовсем
+    client.aio.caches.create.side_effect = gp.genai_errors.ClientError(
+        400, {"error": {"message": "too few tokens", "status": "INVALID_ARGUMENT"}}
+    )
+    broken = gp._ContextCachedConfig(ttl=3600)
+    assert await broken.get() is gp.GENERATE_CONFIG
+    broken._retry_at = 0.0
+    assert await broken.get() is gp.GENERATE_CONFIG
+    assert client.aio.caches.create.await_count == 2
+
+    # Временная ошибка – без кеша до бэк-оффа, затем новая попытка
+    client.aio.caches.create.side_effect = RuntimeError("connection reset")
+    flaky = gp._ContextCachedConfig(ttl=3600)
+    assert await flaky.get() is gp.GENERATE_CONFIG
+    assert await flaky.get() is gp.GENERATE_CONFIG
+    assert client.aio.caches.create.await_count == 3
+    client.aio.caches.create.side_effect = None
+    flaky._retry_at = 0.0
+    assert (await flaky.get()).cached_content == "cachedContents/abc"
+    assert client.aio.caches.create.await_count == 4
+
+
+@pytest.mark.asyncio
+async def test_parse_sms_llm_with_stubbed_gemini(mocker, tmp_path):
+    import libs.gemini_parser as gp
+
+    mocker.patch.object(gp, "_cache", gp._ResponseCache(str(tmp_path)))
+    call = mocker.patch.object(gp, "call_gemini", new_callable=mocker.AsyncMock)
+    call.return_value = {
+        "txn_type": "debit", "date": "10.06.2025 20:51", "amount": "27,252.00",
+        "currency": "amd", "card": "***7538", "merchant": "AMERIABANK API GATE",
+        "city": "AM", "address": "null", "balance": "391,469.09",
+    }
+    body = CASES[2][0]
+
+    for _ in range(2):      # второй проход – из кеша, без запроса к Gemini
+        result = await parse_sms_llm(_mk_raw(body))
+        assert result is not None
+        assert result.card == "7538"
+        assert result.amount == Decimal("27252.00")
+        assert result.balance == Decimal("391469.09")
+        assert result.currency == "AMD"
+        assert result.address == ""
+        assert result.date == datetime(2025, 6, 10, 20, 51)
+    call.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_parse_sms_llm_batch_runs_requests_concurrently(mocker, tmp_path):
+    import asyncio
+    import libs.gemini_parser as gp
+
+    mocker.patch.object(gp, "_cache", gp._ResponseCache(str(tmp_path)))
+    in_flight = peak = 0
+
+    async def _fake_gemini(contents, config):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        body = contents[0].parts[0].text
+        if "CARD:" not in body:
+            return {"txn_type": "debit", "date": "10.06.2025 20:51", "amount": "1",
+                    "currency": "AMD", "card": "", "merchant": "", "city": "",
+                    "address": "", "balance": "1"}
+        return {"txn_type": "debit", "date": "10.06.2025 20:51", "amount": "1",
+                "currency": "AMD", "card": body.split("CARD:")[1][:4], "merchant": "M",
+                "city": "AM", "address": "", "balance": "1"}
+
+    mocker.patch.object(gp, "call_gemini", side_effect=_fake_gemini)
+    raws = [_mk_raw(f"DEBIT 1 AMD 4083***{1000 + i} 10.06.2025 20:51") for i in range(5)]
+    raws.insert(2, _mk_raw("DEBIT 1 AMD без карты 10.06.2025 20:51"))
+
+    results = await gp.parse_sms_llm_batch(raws, concurrency=3)
+
+    assert peak == 3
+    assert isinstance(results[2], gp.BrokenMessage)
+    assert [r.card for i, r in enumerate(results) if i != 2] == ["1000", "1001", "1002", "1003", "1004"]
+
+    # Обёртка `parse` (метрики воркера) вызывается на каждое сообщение
+    seen: list[str] = []
+
+    async def _parse(raw):
+        seen.append(raw.msg_id)
+        return await gp.parse_sms_llm(raw)
+
+    await gp.parse_sms_llm_batch(raws[:2], parse=_parse)
+    assert seen == [raws[0].msg_id, raws[1].msg_id]
+
+
+@pytest.mark.asyncio
+async def test_parse_sms_llm_skips_service_messages(mocker):
+    import libs.gemini_parser as gp
+
+    call = mocker.patch.object(gp, "call_gemini", new_callable=mocker.AsyncMock)
+    assert await parse_sms_llm(_mk_raw("Your OTP is 1234")) is None
+    call.assert_not_awaited()
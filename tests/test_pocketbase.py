@@ -0,0 +1,174 @@
+# tests/test_pocketbase.py
+import hashlib
+import json
+import time
+
+import httpx
+import pytest
+
+from libs.pocketbase import FIND_IDS_CHUNK, AsyncPocketBaseClient, FilterValueError, _msg_id_filter
+
+pytestmark = pytest.mark.asyncio
+
+
+def _client_with(handler, **kwargs) -> AsyncPocketBaseClient:
+    client = AsyncPocketBaseClient(base_url="http://pb", email="e", password="p", **kwargs)
+    client._client = httpx.AsyncClient(base_url="http://pb", transport=httpx.MockTransport(handler))
+    return client
+
+
+async def test_upsert_many_searches_once_and_writes_each_record():
+    calls: list[tuple[str, str]] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append((request.method, request.url.path))
+        if request.method == "GET":
+            assert request.url.params["filter"] == "msg_id='a' || msg_id='b'"
+            return httpx.Response(200, json={"items": [{"id": "rec-b", "msg_id": "b"}]})
+        return httpx.Response(200, json=json.loads(request.content))
+
+    client = _client_with(handler)
+    await client.upsert_many("sms_data", [("a", {"msg_id": "a"}), ("b", {"msg_id": "b"})])
+    await client.close()
+
+    assert calls[0] == ("GET", "/api/collections/sms_data/records")
+    assert sorted(calls[1:]) == [
+        ("PATCH", "/api/collections/sms_data/records/rec-b"),
+        ("POST", "/api/collections/sms_data/records"),
+    ]
+
+
+async def test_upsert_many_splits_search_of_full_batch_by_filter_length():
+    # Полная пачка pb_writer (PBWRITER_BATCH_SIZE=100) из sha1-id, как у watcher.py
+    msg_ids = [hashlib.sha1(str(i).encode()).hexdigest() for i in range(100)]
+    searched: list[str] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.method == "GET":
+            flt = request.url.params["filter"]
+            assert len(flt) <= 3500     # лимит длины filter в PocketBase 0.23+
+            terms = flt.split(" || ")
+            assert len(terms) <= FIND_IDS_CHUNK
+            searched.extend(term[len("msg_id='"):-1] for term in terms)
+            return httpx.Response(200, json={"items": [{"id": "rec-0", "msg_id": msg_ids[0]}]})
+        return httpx.Response(200, json={})
+
+    client = _client_with(handler)
+    await client.upsert_many("sms_data", [(m, {"msg_id": m}) for m in msg_ids])
+    await client.close()
+
+    assert sorted(searched) == sorted(msg_ids)
+
+
+async def test_upsert_many_deduplicates_and_skips_empty_batches():
+    calls: list[str] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.method)
+        if request.method == "GET":
+            return httpx.Response(200, json={"items": []})
+        assert json.loads(request.content) == {"msg_id": "a", "v": 2}
+        return httpx.Response(200, json={})
+
+    client = _client_with(handler)
+    await client.upsert_many("sms_data", [])
+    await client.upsert_many("sms_data", [("a", {"msg_id": "a", "v": 1}), ("a", {"msg_id": "a", "v": 2})])
+    await client.close()
+
+    assert calls == ["GET", "POST"]
+    assert _msg_id_filter(["a"])["perPage"] == 1
+
+
+async def test_upsert_without_unique_index_searches_before_writing():
+    calls: list[tuple[str, str]] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append((request.method, request.url.path))
+        if request.method == "GET":
+            found = request.url.params["filter"] == "msg_id='dup'"
+            return httpx.Response(200, json={"items": [{"id": "rec-dup", "msg_id": "dup"}] if found else []})
+        return httpx.Response(200, json={})
+
+    client = _client_with(handler, unique_msg_id=False)
+    await client.upsert("sms_data", {"msg_id": "new"}, msg_id="new")
+    await client.upsert("sms_data", {"msg_id": "dup"}, msg_id="dup")
+    await client.close()
+
+    assert calls == [
+        ("GET", "/api/collections/sms_data/records"),
+        ("POST", "/api/collections/sms_data/records"),
+        ("GET", "/api/collections/sms_data/records"),
+        ("PATCH", "/api/collections/sms_data/records/rec-dup"),
+    ]
+
+
+async def test_upsert_posts_first_and_patches_only_on_duplicate():
+    calls: list[tuple[str, str]] = []
+    existing = {"dup"}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append((request.method, request.url.path))
+        if request.method == "POST":
+            if json.loads(request.content)["msg_id"] in existing:
+                return httpx.Response(400, json={
+                    "data": {"msg_id": {"code": "validation_not_unique", "message": "Value must be unique."}},
+                })
+            return httpx.Response(200, json={})
+        if request.method == "GET":
+            return httpx.Response(200, json={"items": [{"id": "rec-dup", "msg_id": "dup"}]})
+        return httpx.Response(200, json={})
+
+    client = _client_with(handler, unique_msg_id=True)
+    await client.upsert("sms_data", {"msg_id": "new"}, msg_id="new")
+    assert calls == [("POST", "/api/collections/sms_data/records")]
+
+    calls.clear()
+    await client.upsert("sms_data", {"msg_id": "dup"}, msg_id="dup")
+    await client.close()
+    assert calls == [
+        ("POST", "/api/collections/sms_data/records"),
+        ("GET", "/api/collections/sms_data/records"),
+        ("PATCH", "/api/collections/sms_data/records/rec-dup"),
+    ]
+
+
+async def test_get_records_since_fetches_remaining_pages_in_order():
+    pages_requested: list[int] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        page = int(request.url.params["page"])
+        pages_requested.append(page)
+        return httpx.Response(200, json={
+            "page": page, "totalPages": 3, "items": [{"id": f"{page}-{i}"} for i in range(2)],
+        })
+
+    client = _client_with(handler)
+    items = await client.get_records_since("sms_data", "2025-01-01 00:00:00")
+    await client.close()
+
+    assert [item["id"] for item in items] == ["1-0", "1-1", "2-0", "2-1", "3-0", "3-1"]
+    assert pages_requested[0] == 1 and sorted(pages_requested) == [1, 2, 3]
+
+
+def test_msg_id_filter_escapes_quotes_and_rejects_backslashes():
+    flt = _msg_id_filter(["plain", "it's"])["filter"]
+    assert flt == "msg_id='plain' || msg_id='it\\'s'"
+    with pytest.raises(ValueError):
+        _msg_id_filter(["a\\b"])
+
+
+async def test_upsert_many_does_not_retry_invalid_filter_value():
+    requests: list[httpx.Request] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, json={"items": []})
+
+    client = _client_with(handler)
+    started = time.monotonic()
+    with pytest.raises(FilterValueError):
+        await client.upsert_many("sms_data", [("a\\b", {"msg_id": "a\\b"})])
+    await client.close()
+
+    assert requests == []
+    assert time.monotonic() - started < 1     # без бэк-оффа tenacity (2–30 с)
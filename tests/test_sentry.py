@@ -0,0 +1,13 @@
+# tests/test_sentry.py
+from libs.sentry import _TokenBucket, _make_before_send
+
+
+def test_before_send_drops_events_over_the_burst(mocker):
+    clock = mocker.patch("libs.sentry.time.monotonic", return_value=100.0)
+    before_send = _make_before_send(_TokenBucket(60, burst=3))
+
+    assert [before_send({"n": i}, {}) for i in range(4)] == [{"n": 0}, {"n": 1}, {"n": 2}, None]
+
+    clock.return_value = 101.0          # 60/мин → через секунду есть один токен
+    assert before_send({"n": 4}, {}) == {"n": 4}
+    assert before_send({"n": 5}, {}) is None